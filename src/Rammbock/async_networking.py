@@ -0,0 +1,269 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Asyncio based clients and servers for using Rammbock protocols from
+Python code.
+
+Received data is split into messages with the protocol templates as soon
+as it arrives and messages are passed to waiting `get` calls, handlers
+or the message cache of the connection. Nothing here uses the global lock
+of the library, so one event loop can serve any number of connections.
+
+Example:
+| server = await start_tcp_server(protocol, '127.0.0.1', 12345)
+| client = await open_tcp_client(protocol, '127.0.0.1', 12345)
+| connection = await server.accept()
+| client.send(message)
+| received = await connection.get_message(template, timeout=1)
+"""
+import asyncio
+import traceback
+
+from .logger import logger
+from .networking import get_family
+from .templates.message_stream import MessageStream, _MessageCache
+
+
+class AsyncMessageStream(MessageStream):
+    """Message stream fed by an asyncio protocol instead of a socket."""
+
+    def __init__(self, protocol, connection=None):
+        MessageStream.__init__(self, None, protocol)
+        self._connection = connection
+        self._waiters = []
+        self._buffer = bytearray()
+        # References to running handler coroutines, so that they are not
+        # garbage collected before they finish.
+        self._handler_tasks = set()
+        self._header_length = protocol.header_length()
+        if self._header_length < 0:
+            raise AssertionError('Asynchronous streams require protocol %s to have static header length.'
+                                 % protocol.name)
+
+    async def get(self, message_template, timeout=None, header_filter=None, latest=None, lazy=False):
+        matcher = self._get_matcher(message_template.header_parameters, header_filter)
+        msg = self._get_from_cache(message_template, matcher, latest, lazy)
+        if msg:
+            return msg
+        waiter = (matcher, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            header, pdu_bytes = await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            raise AssertionError('Timeout %fs exceeded in message stream.' % float(timeout))
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return self._to_msg(message_template, header, pdu_bytes, lazy)
+
+    def set_handler(self, msg_template, handler_func, header_filter, interval=None):
+        """Sets `handler_func` to be called with received messages matching
+        `msg_template`. The handler is called with the message and the
+        connection and can be a coroutine function."""
+        self._handlers.append((msg_template, handler_func, header_filter))
+
+    def feed(self, data):
+        """Adds received bytes and dispatches all whole messages in them."""
+        self._buffer += data
+        while len(self._buffer) >= self._header_length:
+            length = self._protocol.get_frame_length(bytes(self._buffer[:self._header_length]))
+            if len(self._buffer) < length:
+                return
+            frame = bytes(self._buffer[:length])
+            del self._buffer[:length]
+            self._dispatch(*self._protocol._split_frame(frame, self._header_length))
+
+    def _dispatch(self, header, pdu_bytes):
+        for matcher, future in self._waiters:
+            if not future.done() and matcher(header):
+                self._waiters.remove((matcher, future))
+                future.set_result((header, pdu_bytes))
+                return
+        self._call_handlers([self._match_or_cache(header, pdu_bytes)])
+
+    def _call_handler_function(self, func, msg):
+        result = func(msg, self._connection)
+        if asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            self._handler_tasks.add(task)
+            task.add_done_callback(self._handler_done)
+
+    def _handler_done(self, task):
+        self._handler_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            error = task.exception()
+            logger.warn('Failure in message handler: %s' %
+                        ''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+    def empty(self):
+        self._cache = _MessageCache()
+        self._buffer = bytearray()
+
+    def close(self):
+        for _, future in self._waiters:
+            future.cancel()
+        self._waiters = []
+        self.empty()
+
+
+class _AsyncNode(object):
+    _transport = None
+
+    def __init__(self, protocol):
+        self._protocol = protocol
+        self._message_stream = AsyncMessageStream(protocol, self)
+        self.closed = asyncio.get_running_loop().create_future()
+
+    async def get_message(self, message_template, timeout=None, header_filter=None, latest=None, lazy=False):
+        if self._protocol != message_template._protocol:
+            raise AssertionError('Template protocol does not match network node protocol %s!=%s' % (
+                self._protocol.name, message_template._protocol.name))
+        return await self._message_stream.get(message_template, timeout=timeout, header_filter=header_filter,
+                                              latest=latest, lazy=lazy)
+
+    def set_handler(self, msg_template, handler_func, header_filter=None):
+        self._message_stream.set_handler(msg_template, handler_func, header_filter)
+
+    def get_own_address(self):
+        return self._transport.get_extra_info('sockname')[:2]
+
+    def get_messages_count_in_buffer(self):
+        return len(self._message_stream._cache)
+
+    def _send_bytes(self, msg):
+        return getattr(msg, '_raw', msg)
+
+    def close(self):
+        if self._transport:
+            self._transport.close()
+        self._message_stream.close()
+
+
+class AsyncStreamConnection(_AsyncNode, asyncio.Protocol):
+    """TCP client or a connection accepted by `AsyncStreamServer`."""
+
+    def __init__(self, protocol, server=None):
+        _AsyncNode.__init__(self, protocol)
+        self.parent = server
+
+    def connection_made(self, transport):
+        self._transport = transport
+        if self.parent:
+            self.parent._connection_made(self)
+
+    def data_received(self, data):
+        self._message_stream.feed(data)
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+    def send(self, msg):
+        self._transport.write(self._send_bytes(msg))
+
+    def get_peer_address(self):
+        return self._transport.get_extra_info('peername')[:2]
+
+
+class AsyncDatagramNode(_AsyncNode, asyncio.DatagramProtocol):
+    """UDP client or server. Server sends to the latest peer by default."""
+    _peer = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._peer = transport.get_extra_info('peername')
+
+    def datagram_received(self, data, address):
+        self._peer = address
+        self._message_stream.feed(data)
+
+    def error_received(self, exc):
+        logger.debug('Error in asynchronous UDP node: %s' % exc)
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+    def send(self, msg):
+        if not self._peer:
+            raise AssertionError('No peer to send to.')
+        self.send_to(msg, *self._peer[:2])
+
+    def send_to(self, msg, ip, port):
+        self._transport.sendto(self._send_bytes(msg), (ip, int(port)))
+
+    def get_peer_address(self):
+        return self._peer[:2] if self._peer else None
+
+
+class AsyncStreamServer(object):
+
+    def __init__(self, protocol):
+        self._protocol = protocol
+        self._server = None
+        self._accepted = asyncio.Queue()
+        self.connections = []
+
+    def _create_connection(self):
+        return AsyncStreamConnection(self._protocol, server=self)
+
+    def _connection_made(self, connection):
+        self.connections.append(connection)
+        self._accepted.put_nowait(connection)
+
+    async def accept(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._accepted.get(), timeout)
+        except asyncio.TimeoutError:
+            raise AssertionError('Timeout %fs exceeded while waiting for connection.' % float(timeout))
+
+    def get_own_address(self):
+        return self._server.sockets[0].getsockname()[:2]
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self._server.close()
+
+
+async def start_tcp_server(protocol, ip, port, family=None):
+    server = AsyncStreamServer(protocol)
+    server._server = await asyncio.get_running_loop().create_server(
+        server._create_connection, ip, int(port), family=get_family(family), reuse_address=True)
+    return server
+
+
+async def open_tcp_client(protocol, server_ip, server_port, own_ip=None, own_port=None, family=None):
+    _, client = await asyncio.get_running_loop().create_connection(
+        lambda: AsyncStreamConnection(protocol), server_ip, int(server_port), family=get_family(family),
+        local_addr=_get_local_address(own_ip, own_port))
+    return client
+
+
+async def start_udp_server(protocol, ip, port, family=None):
+    _, server = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: AsyncDatagramNode(protocol), local_addr=(ip, int(port)), family=get_family(family))
+    return server
+
+
+async def open_udp_client(protocol, server_ip, server_port, own_ip=None, own_port=None, family=None):
+    _, client = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: AsyncDatagramNode(protocol), remote_addr=(server_ip, int(server_port)),
+        local_addr=_get_local_address(own_ip, own_port), family=get_family(family))
+    return client
+
+
+def _get_local_address(ip, port):
+    if not ip and not port:
+        return None
+    return ip or '', int(port or 0)
@@ -41,6 +41,17 @@ except NameError as name_error:
 
 LONGLONG = struct.Struct('>Q')
 
+# TBCD stores two digits per byte, the first one in the low nibble. Odd
+# number of digits is completed with filler 0xf in the last high nibble.
+_TBCD_DIGITS = ['%d' % (byte & 0xf) if byte >> 4 == 0xf else '%d%d' % (byte & 0xf, byte >> 4)
+                for byte in range(256)]
+_TBCD_BYTES = dict(('%d%d' % (first, second), first | second << 4)
+                   for first in range(10) for second in range(10))
+_TBCD_BYTES.update(('%d' % digit, 0xf0 | digit) for digit in range(10))
+# Tables for taking digits that start from the high nibble of a byte.
+_HIGH_NIBBLES = bytes(byte >> 4 for byte in range(256))
+_LOW_NIBBLES_TO_HIGH = bytes((byte & 0xf) << 4 for byte in range(256))
+
 
 def to_bin(string_value):
     if string_value in (None, ''):
@@ -75,6 +86,21 @@ def to_bin_of_length(length, string_value):
     return bin.rjust(length, b'\x00')
 
 
+def encode_uint(value, length, little_endian=False):
+    """Returns non-negative integer `value` as `length` bytes."""
+    try:
+        return value.to_bytes(length, 'little' if little_endian else 'big')
+    except OverflowError:
+        raise AssertionError('Too long binary value %s (max length %d)'
+                             % (value, length))
+
+
+def decode_int(binary, signed=False, little_endian=False):
+    """Returns integer value of bytes `binary`."""
+    return int.from_bytes(binary, 'little' if little_endian else 'big',
+                          signed=signed)
+
+
 def to_hex(binary):
     return binascii.hexlify(binary)
 
@@ -95,33 +121,41 @@ def to_bin_str_from_int_string(length, value):
 
 
 def to_tbcd_value(binary):
-    bin_str, value = to_binary_string_of_length(len(to_hex(binary)) *
-                                                4, binary), ""
-    for index in range(2, len(bin_str), 8):
-        if int(bin_str[index:index + 4], 2) == 15:
-            return value + str(int(bin_str[index + 4: index + 8], 2))
-        value += "%s%s" % (int(bin_str[index + 4:index + 8], 2),
-                           int(bin_str[index: index + 4], 2))
-    return value
+    digits = []
+    for byte in bytes(binary):
+        digits.append(_TBCD_DIGITS[byte])
+        if byte >> 4 == 0xf:
+            break
+    return ''.join(digits)
 
 
 def to_tbcd_binary(tbcd_string):
-    value, index = "0b", 0
-    while index <= len(tbcd_string) - 2:
-        value += to_bin_str_from_int_string(4, tbcd_string[index + 1]) +\
-            to_bin_str_from_int_string(4, tbcd_string[index])
-        index += 2
-    return to_bin(value if index == len(tbcd_string)
-                  else value + to_bin_str_from_int_string(4, 15) +
-                  to_bin_str_from_int_string(4, tbcd_string[index]))
+    try:
+        return bytes(_TBCD_BYTES[tbcd_string[index:index + 2]]
+                     for index in range(0, len(tbcd_string), 2))
+    except KeyError:
+        raise AssertionError('Invalid TBCD value %s' % tbcd_string)
+
+
+def to_tbcd_digits(binary, first, count):
+    """Returns TBCD binary of `count` digits of `binary` starting from digit
+    `first` without converting the digits to a string."""
+    start, size = first // 2, (count + 1) // 2
+    if first % 2:
+        high = bytes(binary[start:start + size]).translate(_HIGH_NIBBLES)
+        low = bytes(binary[start + 1:start + 1 + size]).translate(_LOW_NIBBLES_TO_HIGH)
+        result = bytearray(a | b for a, b in zip(high, low.ljust(size, b'\x00')))
+    else:
+        result = bytearray(binary[start:start + size])
+    if count % 2:
+        result[-1] |= 0xf0
+    return bytes(result)
 
 
 def to_twos_comp(val, bits):
     """compute the 2's compliment of int value val"""
-    if not val.startswith('-'):
-        return to_int(val)
-    value = _invert(to_bin_str_from_int_string(bits, bin(to_int(val[1:]))))
-    return int(value, 2) + 1
+    value = to_int(val)
+    return value + (1 << bits) if value < 0 else value
 
 
 def from_twos_comp(val, bits):
@@ -131,10 +165,6 @@ def from_twos_comp(val, bits):
     return val
 
 
-def _invert(value):
-    return "".join(str(int(a) ^ 1) for a in value)
-
-
 def to_int(string_value):
     if string_value in (None, ''):
         raise Exception("No value or empty value given")
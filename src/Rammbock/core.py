@@ -14,15 +14,17 @@
 
 
 import copy
+import socket
 from contextlib import contextmanager
 
 from .binary_tools import to_0xhex, to_bin
-from .logger import logger
+from .logger import logger, Deferred
 from .message import _StructuredElement
+from .message_image import MessageImage
 from .message_sequence import MessageSequence
 from .networking import (TCPServer, TCPClient, UDPServer, UDPClient, SCTPServer,
                          SCTPClient, _NamedCache)
-from .synchronization import SynchronizedType
+from .synchronization import SynchronizedType, released
 from .templates import (Protocol, UInt, Int, PDU, MessageTemplate, Char, Binary,
                         TBCD, StructTemplate, ListTemplate, UnionTemplate,
                         BinaryContainerTemplate, ConditionalTemplate,
@@ -34,7 +36,9 @@ class RammbockCore(object, metaclass=SynchronizedType):
     ROBOT_LIBRARY_SCOPE = 'GLOBAL'
     run = False
 
-    def __init__(self):
+    def __init__(self, handler_log_capacity=None):
+        if handler_log_capacity:
+            logger.set_capacity(handler_log_capacity)
         self._init_caches()
 
     def _init_caches(self):
@@ -70,9 +74,9 @@ class RammbockCore(object, metaclass=SynchronizedType):
         The header_filter defines which header field will be used to identify the
         message defined in template. (Otherwise all incoming messages will match!)
 
-        The interval defines the interval in seconds on which the handler will
-        be called on background. By default the incoming messages are checked
-        every 0.5 seconds.
+        Messages are passed to the handler on background as soon as they are
+        received. The interval defines in seconds how often messages already
+        received by other keywords are checked. By default it is 0.5 seconds.
 
         The handler function will be called with two arguments: the rammbock library
         instance and the received message.
@@ -105,9 +109,9 @@ class RammbockCore(object, metaclass=SynchronizedType):
         The header_filter defines which header field will be used to identify the
         message defined in template. (Otherwise all incoming messages will match!)
 
-        The interval defines the interval in seconds on which the handler will
-        be called on background. By default the incoming messages are checked
-        every 0.5 seconds.
+        Messages are passed to the handler on background as soon as they are
+        received. The interval defines in seconds how often messages already
+        received by other keywords are checked. By default it is 0.5 seconds.
 
         The alias is the alias for the connection. By default the current active
         connection will be used.
@@ -172,6 +176,7 @@ class RammbockCore(object, metaclass=SynchronizedType):
     def end_protocol(self):
         """End protocol definition."""
         protocol = self._get_message_template()
+        protocol.compile()
         self._protocols[protocol.name] = protocol
         self._protocol_in_progress = False
 
@@ -367,7 +372,9 @@ class RammbockCore(object, metaclass=SynchronizedType):
         | Server sends binary | ${some binary} | connection=my_connection |
         """
         server, name = self._servers.get_with_name(name)
-        server.send(message.encode(), alias=connection)
+        if isinstance(message, str):
+            message = message.encode()
+        server.send(message, alias=connection)
         self._register_send(server, label, name, connection=connection)
 
     def client_receives_binary(self, name=None, timeout=None, label=None):
@@ -453,6 +460,7 @@ class RammbockCore(object, metaclass=SynchronizedType):
         if isinstance(unlocked, str):
             unlocked = unlocked.lower() != 'false'
         template = self._get_message_template()
+        template.compile()
         if not unlocked:
             template.set_as_saved()
         self._message_templates[name] = (template, self._field_values)
@@ -502,9 +510,23 @@ class RammbockCore(object, metaclass=SynchronizedType):
         _, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
         return self._encode_message(message_fields, header_fields)
 
+    def get_message_image(self, *parameters):
+        """Get message encoded to a message image.
+
+        Message image is encoded once and can then be sent many times with
+        `Client sends message image` and `Server sends message image`, which
+        change only the given `uint` and `int` fields. Optional parameters
+        are message field values separated with colon.
+
+        Examples:
+        | ${image} = | Get message image |
+        | ${image} = | Get message image | field_name:value | header:message_code:0x32 |
+        """
+        return MessageImage(self.get_message(*parameters))
+
     def _encode_message(self, message_fields, header_fields):
         msg = self._get_message_template().encode(message_fields, header_fields)
-        logger.debug('%s' % repr(msg))
+        logger.debug(Deferred(repr, msg))
         return msg
 
     def _get_message_template(self):
@@ -545,7 +567,101 @@ class RammbockCore(object, metaclass=SynchronizedType):
     def _send_message(self, callback, parameters):
         configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
         msg = self._encode_message(message_fields, header_fields)
-        callback(msg._fields['foo']._value, label=self._current_container.name, **configs)
+        callback(msg._raw, label=self._current_container.name, **configs)
+
+    def client_sends_message_image(self, image, *parameters):
+        """Send a message image created with `Get message image`.
+
+        Optional parameters are client `name` and message `label` separated
+        with equals and new values of integer fields separated with colon.
+        Protocol header values can be set with syntax header:header_field_name:value.
+        Other fields are sent as they were when the image was created.
+
+        Examples:
+        | Client sends message image | ${image} |
+        | Client sends message image | ${image} | seq:${i} | header:teid:0x1234 | name=Client1 |
+        """
+        self._send_message_image(self.client_sends_binary, image, parameters)
+
+    def server_sends_message_image(self, image, *parameters):
+        """Send a message image created with `Get message image`.
+
+        Optional parameters are server `name`, possible `connection` alias and
+        message `label` separated with equals and new values of integer fields
+        separated with colon. Protocol header values can be set with syntax
+        header:header_field_name:value.
+
+        Examples:
+        | Server sends message image | ${image} |
+        | Server sends message image | ${image} | seq:${i} | connection=my_connection |
+        """
+        self._send_message_image(self.server_sends_binary, image, parameters)
+
+    def client_sends_messages(self, messages, *parameters):
+        """Send many messages defined with `New Message` with one keyword call.
+
+        `messages` is either the number of messages to send or a list of
+        parameter sets, one for each message. A parameter set is a list of
+        message field values separated with colon or a single such value.
+
+        Other parameters are the same as with `Client sends message` and are
+        used for all messages. All messages are encoded before sending and TCP
+        clients send them with one call.
+
+        Examples:
+        | Client sends messages | 100 |
+        | ${sequence numbers} = | Evaluate | ['seq:%d' % i for i in range(1000)] |
+        | Client sends messages | ${sequence numbers} | name=Client1 | header:msgId:5 |
+        """
+        msgs, configs = self._encode_messages(messages, parameters)
+        self._send_binaries(self._clients, msgs, **configs)
+
+    def server_sends_messages(self, messages, *parameters):
+        """Send many messages defined with `New Message` with one keyword call.
+
+        `messages` is either the number of messages to send or a list of
+        parameter sets, one for each message. See `Client sends messages` for
+        details.
+
+        Other parameters are the same as with `Server sends message` and are
+        used for all messages.
+
+        Examples:
+        | Server sends messages | 100 |
+        | Server sends messages | ${parameter sets} | connection=my_connection |
+        """
+        msgs, configs = self._encode_messages(messages, parameters)
+        self._send_binaries(self._servers, msgs, **configs)
+
+    def _encode_messages(self, messages, parameters):
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        configs.setdefault('label', self._current_container.name)
+        template = self._get_message_template()
+        msgs = []
+        for parameter_set in self._get_parameter_sets(messages):
+            _, fields, headers = self._parse_parameters(parameter_set)
+            msg_fields, msg_headers = message_fields.copy(), header_fields.copy()
+            msg_fields.update(fields)
+            msg_headers.update(headers)
+            msgs.append(template.encode(msg_fields, msg_headers)._raw)
+        return msgs, configs
+
+    def _get_parameter_sets(self, messages):
+        if isinstance(messages, (int, str)):
+            return [()] * int(messages)
+        return [(parameter_set,) if isinstance(parameter_set, str) else parameter_set
+                for parameter_set in messages]
+
+    def _send_binaries(self, nodes, msgs, name=None, connection=None, label=None):
+        node, name = nodes.get_with_name(name)
+        node.send_messages(msgs, alias=connection)
+        for _ in msgs:
+            self._register_send(node, label, name, connection=connection)
+
+    def _send_message_image(self, callback, image, parameters):
+        configs, message_fields, header_fields = self._parse_parameters(parameters)
+        configs.setdefault('label', image.name)
+        callback(image.patch(message_fields, header_fields), **configs)
 
     def client_receives_message(self, *parameters):
         """Receive a message with template defined using `New Message` and
@@ -558,6 +674,7 @@ class RammbockCore(object, metaclass=SynchronizedType):
         - `name` the client name (default is the latest used) example: `name=Client 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `lazy` if set to True, message fields are decoded only when they are accessed. Default is False. Example: `lazy=True`
         -  message field values for validation separated with colon. example: `some_field:0xaf05`
 
         Examples:
@@ -565,8 +682,8 @@ class RammbockCore(object, metaclass=SynchronizedType):
         | ${msg} = | Client receives message | name=Client1 | timeout=5 |
         | ${msg} = | Client receives message | message_field:(0|1) |
         """
-        with self._receive(self._clients, *parameters) as (msg, message_fields, header_fields):
-            self._validate_message(msg, message_fields, header_fields)
+        with self._receive(self._clients, *parameters) as (msg, template, message_fields, header_fields):
+            self._validate_message(msg, message_fields, header_fields, template)
             return msg
 
     def client_receives_without_validation(self, *parameters):
@@ -579,12 +696,13 @@ class RammbockCore(object, metaclass=SynchronizedType):
         - `name` the client name (default is the latest used) example: `name=Client 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `lazy` if set to True, message fields are decoded only when they are accessed. Default is False. Example: `lazy=True`
 
         Examples:
         | ${msg} = | Client receives without validation |
         | ${msg} = | Client receives without validation | name=Client1 | timeout=5 |
         """
-        with self._receive(self._clients, *parameters) as (msg, _, _):
+        with self._receive(self._clients, *parameters) as (msg, _, _, _):
             return msg
 
     def server_receives_message(self, *parameters):
@@ -599,6 +717,7 @@ class RammbockCore(object, metaclass=SynchronizedType):
         - `connection` alias. example: `connection=connection 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `lazy` if set to True, message fields are decoded only when they are accessed. Default is False. Example: `lazy=True`
         -  message field values for validation separated with colon. example: `some_field:0xaf05`
 
         Optional parameters are server `name`, `connection` alias and
@@ -610,8 +729,8 @@ class RammbockCore(object, metaclass=SynchronizedType):
         | ${msg} = | Server receives message | name=Server1 | alias=my_connection | timeout=5 |
         | ${msg} = | Server receives message | message_field:(0|1) |
         """
-        with self._receive(self._servers, *parameters) as (msg, message_fields, header_fields):
-            self._validate_message(msg, message_fields, header_fields)
+        with self._receive(self._servers, *parameters) as (msg, template, message_fields, header_fields):
+            self._validate_message(msg, message_fields, header_fields, template)
             return msg
 
     def server_receives_without_validation(self, *parameters):
@@ -625,14 +744,76 @@ class RammbockCore(object, metaclass=SynchronizedType):
         - `connection` alias. example: `connection=connection 1`
         - `timeout` for receiving message. example: `timeout=0.1`
         - `latest` if set to True, get latest message from buffer instead first. Default is False. Example: `latest=True`
+        - `lazy` if set to True, message fields are decoded only when they are accessed. Default is False. Example: `lazy=True`
 
         Examples:
         | ${msg} = | Server receives without validation |
         | ${msg} = | Server receives without validation | name=Server1 | alias=my_connection | timeout=5 |
         """
-        with self._receive(self._servers, *parameters) as (msg, _, _):
+        with self._receive(self._servers, *parameters) as (msg, _, _, _):
             return msg
 
+    def client_receives_messages(self, *parameters):
+        """Receive many messages with template defined using `New Message` and
+        validate their field values with one keyword call.
+
+        Optional parameters are the same as with `Client receives message`
+        and `count` of messages to receive, by default 1. Messages are
+        received until `count` messages have been received or receiving a
+        message fails, for example because of a timeout.
+
+        Failing validation or receiving does not fail this keyword. Returns a
+        list of received messages with attributes `count` of received
+        messages, number of `errors` and the error message of the
+        `first_failure` or None.
+
+        Examples:
+        | ${msgs} = | Client receives messages | count=1000 | timeout=1 | status:0 |
+        | Should be equal as integers | ${msgs.errors} | 0 | ${msgs.first_failure} |
+        """
+        return self._receive_messages(self._clients, parameters)
+
+    def server_receives_messages(self, *parameters):
+        """Receive many messages with template defined using `New Message` and
+        validate their field values with one keyword call.
+
+        Optional parameters are the same as with `Server receives message`
+        and `count` of messages to receive, by default 1. See `Client receives
+        messages` for details and the returned value.
+
+        Examples:
+        | ${msgs} = | Server receives messages | count=1000 | alias=my_connection | status:0 |
+        | Should be equal as integers | ${msgs.count} | 1000 |
+        """
+        return self._receive_messages(self._servers, parameters)
+
+    def _receive_messages(self, nodes, parameters):
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        count = int(configs.pop('count', 1))
+        node, name = nodes.get_with_name(configs.pop('name', None))
+        template = self._get_message_template()
+        received, receive_error = ReceivedMessages(), None
+        with released(self):
+            try:
+                for msg in node.get_messages(template, count, **configs):
+                    received.append(msg)
+            except socket.timeout:
+                receive_error = 'Timeout exceeded while receiving messages.'
+            except AssertionError as e:
+                receive_error = e.args[0]
+        validate = template.get_validator(message_fields, header_fields)
+        for msg in received:
+            errors = validate(msg)
+            if errors:
+                received.add_failure(errors[0])
+            self._register_receive(node, template.name, name, error=errors[0] if errors else '')
+        if receive_error:
+            received.add_failure(receive_error)
+        if received.errors:
+            logger.info('%d failures when receiving %d messages. First failure: %s'
+                        % (received.errors, len(received), received.first_failure))
+        return received
+
     def validate_message(self, msg, *parameters):
         """Validates given message using template defined with `New Message` and
         field values given as optional arguments.
@@ -644,8 +825,9 @@ class RammbockCore(object, metaclass=SynchronizedType):
         _, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
         self._validate_message(msg, message_fields, header_fields)
 
-    def _validate_message(self, msg, message_fields, header_fields):
-        errors = self._get_message_template().validate(msg, message_fields, header_fields)
+    def _validate_message(self, msg, message_fields, header_fields, template=None):
+        template = template or self._get_message_template()
+        errors = template.validate(msg, message_fields, header_fields)
         if errors:
             logger.info("Validation failed for %s" % repr(msg))
             logger.info('\n'.join(errors))
@@ -655,13 +837,18 @@ class RammbockCore(object, metaclass=SynchronizedType):
     def _receive(self, nodes, *parameters):
         configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
         node, name = nodes.get_with_name(configs.pop('name', None))
-        msg = node.get_message(self._get_message_template(), **configs)
+        template = self._get_message_template()
+        # Handlers running on background may use the library and load other
+        # templates while this thread waits for the message. The message is
+        # decoded and validated with the template and values taken here.
+        with released(self):
+            msg = node.get_message(template, **configs)
         try:
-            yield msg, message_fields, header_fields
-            self._register_receive(node, self._current_container.name, name)
-            logger.debug("Received %s" % repr(msg))
+            yield msg, template, message_fields, header_fields
+            self._register_receive(node, template.name, name)
+            logger.debug(Deferred("Received {!r}".format, msg))
         except AssertionError as e:
-            self._register_receive(node, self._current_container.name, name, error=e.args[0])
+            self._register_receive(node, template.name, name, error=e.args[0])
             raise e
 
     def uint(self, length, name, value=None, align=None):
@@ -929,7 +1116,10 @@ class RammbockCore(object, metaclass=SynchronizedType):
         return config, fields, headers
 
     def _populate_defaults(self, fields, default_values):
-        ret_val = default_values
+        # Returns a new dictionary, so that values given to one keyword call
+        # do not change the defaults and handlers running meanwhile do not
+        # change the values of the call.
+        ret_val = dict(default_values)
         ret_val.update(fields)
         return ret_val
 
@@ -1070,4 +1260,22 @@ class RammbockCore(object, metaclass=SynchronizedType):
         Example:
         | Switch Server | server |
         """
-        self._servers.set_current(name)
\ No newline at end of file
+        self._servers.set_current(name)
+
+
+class ReceivedMessages(list):
+    """Messages received with one keyword call and statistics of failures."""
+
+    def __init__(self):
+        list.__init__(self)
+        self.errors = 0
+        self.first_failure = None
+
+    @property
+    def count(self):
+        return len(self)
+
+    def add_failure(self, error):
+        self.errors += 1
+        if self.first_failure is None:
+            self.first_failure = error
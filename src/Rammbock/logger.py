@@ -12,6 +12,6 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-from .robotbackgroundlogger import BackgroundLogger
+from .robotbackgroundlogger import BackgroundLogger, Deferred
 
 logger = BackgroundLogger()
@@ -13,27 +13,51 @@
 #  limitations under the License.
 
 from math import ceil
+import struct
 from .binary_tools import to_0xhex, to_binary_string_of_length, \
-    to_bin_of_length, to_tbcd_value, to_tbcd_binary, from_twos_comp
-from .ordered_dict import OrderedDict
+    to_tbcd_value, to_tbcd_binary, decode_int
+
+
+# Attributes that are never message fields. Looking them up must not fall
+# back to fields, as that would recurse while the object is not complete,
+# for example when it is being copied.
+_INTERNAL_ATTRIBUTES = frozenset(['_fields', '_decoded', '_decoder', '_parent'])
 
 
 class _StructuredElement(object):
+    """Element with child fields.
+
+    Length is calculated once and cached. Changing children clears the
+    cached length of the element and of its parents. Calculating the length
+    of an element caches the lengths of its children, so clearing can stop
+    at the first parent without a cached length.
+    """
+    __slots__ = ('_name', '_fields', '_parent', '_cached_length')
     _type = None
 
     def __init__(self, name):
         self._name = name
-        self._fields = OrderedDict()
+        self._fields = {}
         self._parent = None
+        self._cached_length = None
 
     def __setitem__(self, name, child):
         self._fields[str(name)] = child
         child._parent = self
+        self._clear_cached_length()
+
+    def _clear_cached_length(self):
+        element = self
+        while element is not None and element._cached_length is not None:
+            element._cached_length = None
+            element = element._parent
 
     def __getitem__(self, name):
         return self._fields[str(name)]
 
     def __getattr__(self, name):
+        if name.startswith('__') or name in _INTERNAL_ATTRIBUTES:
+            raise AttributeError(name)
         return self[name]
 
     def __delitem__(self, name):
@@ -41,13 +65,14 @@ class _StructuredElement(object):
         item = self._fields[name]
         del self._fields[name]
         item._parent = None
+        self._clear_cached_length()
 
     def __str__(self):
         return self._get_name()
 
     def __repr__(self):
         result = '%s\n' % str(self._get_name())
-        for field in list(self._fields.values()):
+        for field in self._fields.values():
             result += self._format_indented('%s' % repr(field))
         return result
 
@@ -59,16 +84,28 @@ class _StructuredElement(object):
 
     @property
     def _raw(self):
-        return self._get_raw_bytes()
+        buffer = bytearray(len(self))
+        self._pack_into(buffer, 0)
+        return bytes(buffer)
+
+    def _pack_into(self, buffer, offset):
+        """Writes this element to `buffer` starting from `offset` and
+        returns the offset after it. Padding is left untouched, so `buffer`
+        must be zero filled."""
+        for field in self._fields.values():
+            offset = field._pack_into(buffer, offset)
+        return offset
 
     def _get_name(self):
         return '%s %s' % (self._type, self._name)
 
-    def _get_raw_bytes(self):
-        return (field._raw for field in list(self._fields.values()))
-
     def __len__(self):
-        return sum(len(field) for field in list(self._fields.values()))
+        if self._cached_length is None:
+            self._cached_length = self._calculate_length()
+        return self._cached_length
+
+    def _calculate_length(self):
+        return sum(len(field) for field in self._fields.values())
 
     def __bool__(self):
         return True
@@ -81,12 +118,11 @@ class _StructuredElement(object):
 
 
 class List(_StructuredElement):
-    _type = 'List'
+    __slots__ = ('_type',)
 
     def __init__(self, name, type_name):
-        self._name, self._type = name, type_name
-        self._fields = OrderedDict()
-        self._parent = None
+        _StructuredElement.__init__(self, name)
+        self._type = type_name
 
     def _get_name(self):
         return '%s %s[]' % (self._type, self._name)
@@ -100,59 +136,69 @@ class List(_StructuredElement):
 
 
 class Bag(_StructuredElement):
+    __slots__ = ('_cached_count',)
     _type = 'Bag'
 
     def __init__(self, name):
-        self._name = name
-        self._fields = OrderedDict()
-        self._parent = None
+        _StructuredElement.__init__(self, name)
+        self._cached_count = None
 
     @property
     def len(self):
-        return sum(field.len for field in list(self._fields.values()))
+        # Count is cached only together with the length. Calculating the
+        # length caches the lengths of the cases, so changing a case clears
+        # the length and with it the count.
+        if self._cached_length is None:
+            len(self)
+        if self._cached_count is None:
+            self._cached_count = sum(field.len for field in self._fields.values())
+        return self._cached_count
+
+    def _calculate_length(self):
+        self._cached_count = None
+        return _StructuredElement._calculate_length(self)
 
 
 class Struct(_StructuredElement):
-    _type = 'Struct'
+    __slots__ = ('_type', '_align')
 
     def __init__(self, name, type_name, align=1):
-        self._name = name
+        _StructuredElement.__init__(self, name)
         self._type = type_name
-        self._fields = OrderedDict()
-        self._parent = None
         self._align = align
 
-    def __len__(self):
-        result = sum(len(field) for field in list(self._fields.values()))
+    def _calculate_length(self):
+        result = sum(len(field) for field in self._fields.values())
         return self._get_aligned(result)
 
     def _get_aligned(self, length):
         return length + (self._align - length % self._align) % self._align
 
-    def _get_raw_bytes(self):
-        result = ''.join((field._raw for field in list(self._fields.values())))
-        return result.ljust(self._get_aligned(len(result)), '\x00')
+    def _pack_into(self, buffer, offset):
+        end = offset + len(self)
+        _StructuredElement._pack_into(self, buffer, offset)
+        return end
 
 
 class Union(_StructuredElement):
+    __slots__ = ('_length',)
     _type = 'Union'
 
     def __init__(self, name, length):
         self._length = length
         _StructuredElement.__init__(self, name)
 
-    def _get_raw_bytes(self):
-        max_raw = ''
-        for field in list(self._fields.values()):
-            if len(field._raw) > len(max_raw):
-                max_raw = field._raw
-        return max_raw.ljust(self._length, '\x00')
+    def _pack_into(self, buffer, offset):
+        if self._fields:
+            max(self._fields.values(), key=len)._pack_into(buffer, offset)
+        return offset + self._length
 
     def __len__(self):
         return self._length
 
 
 class BinaryContainer(_StructuredElement):
+    __slots__ = ('_little_endian',)
     _type = 'BinaryContainer'
 
     def __init__(self, name, little_endian=False):
@@ -160,65 +206,146 @@ class BinaryContainer(_StructuredElement):
         _StructuredElement.__init__(self, name)
 
     def _binlength(self):
-        return sum(field.binlength for field in list(self._fields.values()))
+        return sum(field.binlength for field in self._fields.values())
 
-    def __len__(self):
-        return self._binlength() / 8
+    def _calculate_length(self):
+        return self._binlength() // 8
+
+    @property
+    def _raw(self):
+        return self._get_raw_bytes()
+
+    def _pack_into(self, buffer, offset):
+        raw = self._get_raw_bytes()
+        buffer[offset:offset + len(raw)] = raw
+        return offset + len(raw)
 
     def _get_raw_bytes(self):
-        # TODO: faster implementation...
-        result = to_bin_of_length(int(self.__len__()), ' '.join((field.bin for field in list(self._fields.values()))))
-        if self._little_endian:
-            return result[::-1]
-        return result
+        value = 0
+        for field in self._fields.values():
+            bits = int.from_bytes(field._value, 'big')
+            if bits >> field.binlength:
+                raise AssertionError('Too long binary value %s for %d bits in %s'
+                                     % (field.hex, field.binlength, field.name))
+            value = value << field.binlength | bits
+        return value.to_bytes(len(self), 'little' if self._little_endian else 'big')
 
 
 class TBCDContainer(BinaryContainer):
+    __slots__ = ()
     _type = 'TBCDContainer'
 
     def _get_raw_bytes(self):
-        return to_tbcd_binary("".join(field.tbcd for field in list(self._fields.values())))
+        return to_tbcd_binary("".join(field.tbcd for field in self._fields.values()))
 
-    def __len__(self):
-        return int(ceil(sum(len(field.tbcd) for field in list(self._fields.values())) / 2.0))
+    def _calculate_length(self):
+        return int(ceil(sum(len(field.tbcd) for field in self._fields.values()) / 2.0))
 
 
 class Conditional(_StructuredElement):
+    __slots__ = ('exists',)
     _type = 'Conditional'
 
     def __init__(self, name, exists=False):
-        self._name = name
+        _StructuredElement.__init__(self, name)
         self.exists = exists
-        self._fields = OrderedDict()
-        self._parent = None
 
 
 class Message(_StructuredElement):
+    __slots__ = ()
     _type = 'Message'
 
     def _add_header(self, header):
-        new = OrderedDict({'_header': header})
+        new = {'_header': header}
         new.update(self._fields)
         self._fields = new
+        self._clear_cached_length()
 
     def _get_recursive_name(self):
         return ''
 
 
+class LazyMessage(Message):
+    """Message that decodes its fields only when they are accessed.
+
+    Fields with a statically known offset are decoded alone on first access.
+    Anything that needs the whole message, like length, raw bytes or
+    representation, decodes all the remaining fields.
+    """
+    __slots__ = ('_decoder', '_decoded')
+
+    def __init__(self, name, decoder):
+        self._decoder = decoder
+        Message.__init__(self, name)
+
+    @property
+    def _fields(self):
+        if self._decoder:
+            decoder, self._decoder = self._decoder, None
+            decoder.decode_all(self)
+        return self._decoded
+
+    @_fields.setter
+    def _fields(self, fields):
+        self._decoded = fields
+
+    def __setitem__(self, name, child):
+        self._decoded[str(name)] = child
+        child._parent = self
+        self._clear_cached_length()
+
+    def __getitem__(self, name):
+        name = str(name)
+        if name not in self._decoded and self._decoder:
+            self._decoder.decode_field(self, name)
+        return self._decoded[name]
+
+    def __contains__(self, key):
+        key = str(key)
+        if key in self._decoded:
+            return True
+        return bool(self._decoder) and self._decoder.has_field(key)
+
+    def _add_header(self, header):
+        new = {'_header': header}
+        new.update(self._decoded)
+        self._decoded = new
+        self._clear_cached_length()
+
+
 class Header(_StructuredElement):
+    __slots__ = ()
     _type = 'Header'
 
 
 class Field(object):
+    __slots__ = ('_type', '_name', '_data', '_length', '_little_endian', '_parent')
 
     def __init__(self, type, name, value, aligned_len=None, little_endian=False):
         self._type = type
         self._name = name
-        self._original_value = value
+        self._data = value
         self._length = aligned_len or len(value)
         self._little_endian = little_endian
         self._parent = None
 
+    @property
+    def _original_value(self):
+        # Decoded fields hold a view to the received data until the value
+        # is needed.
+        if isinstance(self._data, memoryview):
+            self._data = self._data.tobytes()
+        return self._data
+
+    def __getstate__(self):
+        self._original_value
+        return dict((name, getattr(self, name)) for cls in type(self).__mro__
+                    for name in getattr(cls, '__slots__', ()) if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     @property
     def _value(self):
         return self._original_value[::-1] if self._little_endian else self._original_value
@@ -237,7 +364,7 @@ class Field(object):
         return int(self)
 
     def __int__(self):
-        return int(to_0xhex(self._value), 16)
+        return decode_int(self._original_value, little_endian=self._little_endian)
 
     @property
     def uint(self):
@@ -245,7 +372,7 @@ class Field(object):
 
     @property
     def sint(self):
-        return from_twos_comp(int(self), len(self._value) * 8)
+        return decode_int(self._original_value, signed=True, little_endian=self._little_endian)
 
     @property
     def hex(self):
@@ -284,6 +411,10 @@ class Field(object):
     def _raw(self):
         return self._original_value.ljust(self._length, b'\x00')
 
+    def _pack_into(self, buffer, offset):
+        struct.pack_into('%ds' % self._length, buffer, offset, self._original_value)
+        return offset + self._length
+
     def __str__(self):
         return str(self.__getattribute__(self._type))
 
@@ -302,11 +433,12 @@ class Field(object):
 
 
 class BinaryField(Field):
-    _type = 'bin'
+    __slots__ = ('_binlength',)
 
     def __init__(self, length, name, value, aligned_len=None, little_endian=False):
+        self._type = 'bin'
         self._name = name
-        self._original_value = value
+        self._data = value
         self._binlength = int(length)
         self._length = int(ceil(self._binlength / 8.0))
         self._parent = None
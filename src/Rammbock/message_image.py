@@ -0,0 +1,95 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from .binary_tools import encode_uint, to_int
+from .message import Field, Union, BinaryContainer
+
+
+class MessageImage(object):
+    """Encoded message whose integer fields can be changed without encoding
+    the message again.
+
+    The message is encoded once. Offsets of the `uint` and `int` fields are
+    stored by their names, for example `seq`, `struct.teid` or `list.0.id`,
+    and header fields by their names in the protocol. `patch` returns a copy
+    of the bytes with given fields changed. Lengths never change, so length
+    fields keep their values. Fields inside unions and binary containers can
+    not be patched.
+    """
+
+    def __init__(self, message):
+        self.name = message._name
+        self._bytes = message._raw
+        self._fields = {}
+        self._header_fields = {}
+        offset = 0
+        for name, element in message._fields.items():
+            if name == '_header':
+                self._add_offsets(element, '', offset, self._header_fields)
+            else:
+                self._add_offsets(element, '', offset, self._fields, name)
+            offset += len(element)
+
+    def _add_offsets(self, element, prefix, offset, offsets, name=None):
+        if name is not None:
+            if isinstance(element, Field):
+                if element._type in ('uint', 'int'):
+                    offsets[prefix + name] = (offset, element)
+                return
+            prefix += name + '.'
+        if isinstance(element, (Union, BinaryContainer)):
+            return
+        for child_name, child in element._fields.items():
+            self._add_offsets(child, prefix, offset, offsets, child_name)
+            offset += len(child)
+
+    def __len__(self):
+        return len(self._bytes)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def patch(self, fields=None, header_fields=None):
+        """Returns bytes of the message with `fields` and `header_fields`
+        set to new values."""
+        if not fields and not header_fields:
+            return self._bytes
+        data = bytearray(self._bytes)
+        for offsets, values in ((self._fields, fields), (self._header_fields, header_fields)):
+            for name, value in (values or {}).items():
+                if name not in offsets:
+                    raise AssertionError('Message image %s has no integer field %s.' % (self.name, name))
+                offset, field = offsets[name]
+                binary = self._encode(field, value)
+                data[offset:offset + len(binary)] = binary
+        return bytes(data)
+
+    def _encode(self, field, value):
+        length = len(field._original_value)
+        if not isinstance(value, int):
+            value = to_int(str(value).replace(' ', ''))
+        if field._type == 'int':
+            bits = length * 8
+            if not -(1 << bits - 1) <= value < 1 << bits - 1:
+                raise AssertionError('Value %s out of range (%d..%d)'
+                                     % (value, -(1 << bits - 1), (1 << bits - 1) - 1))
+            value %= 1 << bits
+        return encode_uint(value, length, field._little_endian)
+
+    def __str__(self):
+        return 'Message image %s' % self.name
+
+    def __repr__(self):
+        return '%s (%d bytes)' % (self, len(self))
@@ -13,7 +13,6 @@
 #  limitations under the License.
 
 import subprocess
-from .ordered_dict import OrderedDict
 from .logger import logger
 
 
@@ -30,7 +29,7 @@ def msg_name(protocol, message_name):
 class MessageSequence(object):
 
     def __init__(self):
-        self.operators = OrderedDict()
+        self.operators = {}
         self.sequence = []
 
     def _operator(self, name, ip, port):
@@ -68,7 +67,7 @@ class MessageSequence(object):
             msg[-1] == 'sent'
 
     def get_operators(self):
-        return (operator.name for operator in list(self.operators.values()))
+        return (operator.name for operator in self.operators.values())
 
     def get(self):
         return ((str(elem) for elem in row) for row in self.sequence)
@@ -15,9 +15,10 @@
 
 
 import socket
+import threading
 import time
-from .logger import logger
-from .synchronization import SynchronizedType
+from .logger import logger, Deferred
+from .synchronization import SynchronizedType, released
 from .binary_tools import to_hex
 
 try:
@@ -32,6 +33,12 @@ TCP_BUFFER_SIZE = 1000000
 TCP_MAX_QUEUED_CONNECTIONS = 5
 
 
+def _is_true(value):
+    if isinstance(value, str):
+        return value.lower() not in ('', 'false', 'no', 'none')
+    return bool(value)
+
+
 def get_family(family):
     if not family:
         family = 'ipv4'
@@ -65,6 +72,9 @@ class _NetworkNode(_WithTimeouts, metaclass=SynchronizedType):
     def get_own_address(self):
         return self._socket.getsockname()[:2]
 
+    def fileno(self):
+        return self._socket.fileno()
+
     def get_peer_address(self, alias=None):
         if alias:
             raise AssertionError('Named connections not supported.')
@@ -84,26 +94,46 @@ class _NetworkNode(_WithTimeouts, metaclass=SynchronizedType):
             return None
         return self._protocol.get_message_stream(BufferedStream(self, self._default_timeout))
 
-    def get_message(self, message_template, timeout=None, header_filter=None, latest=None):
+    def get_message(self, message_template, timeout=None, header_filter=None, latest=None, lazy=None):
+        self._verify_can_receive(message_template)
+        # Other threads may send with this node while waiting for the message.
+        with released(self):
+            return self._get_from_stream(message_template, self._message_stream, timeout=timeout,
+                                         header_filter=header_filter, latest=latest, lazy=_is_true(lazy))
+
+    def get_messages(self, message_template, count, timeout=None, header_filter=None, latest=None, lazy=None):
+        """Returns an iterator receiving `count` messages. Messages are
+        received while iterating, without holding the lock of the node."""
+        self._verify_can_receive(message_template)
+        return self._message_stream.get_messages(message_template, count, timeout=timeout,
+                                                 header_filter=header_filter, latest=latest,
+                                                 lazy=_is_true(lazy))
+
+    def _verify_can_receive(self, message_template):
         if not self._protocol:
             raise AssertionError(
                 'Can not receive messages without protocol. Initialize network node with "protocol=<protocl name>"')
         if self._protocol != message_template._protocol:
             raise AssertionError('Template protocol does not match network node protocol %s!=%s' % (
                 self.protocol_name, message_template._protocol.name))
-        return self._get_from_stream(message_template, self._message_stream, timeout=timeout,
-                                     header_filter=header_filter, latest=latest)
 
-    def _get_from_stream(self, message_template, stream, timeout, header_filter, latest):
-        return stream.get(message_template, timeout=timeout, header_filter=header_filter, latest=latest)
+    def _get_from_stream(self, message_template, stream, timeout, header_filter, latest, lazy=False):
+        return stream.get(message_template, timeout=timeout, header_filter=header_filter, latest=latest,
+                          lazy=lazy)
 
     def log_send(self, binary, ip, port):
-        logger.debug("Send %d bytes: %s to %s:%s over %s" % (
-            len(list(binary)), to_hex(binary), ip, port, self._transport_layer_name))
+        logger.debug(Deferred(self._format_send, binary, ip, port))
+
+    def _format_send(self, binary, ip, port):
+        return "Send %d bytes: %s to %s:%s over %s" % (
+            len(binary), to_hex(binary), ip, port, self._transport_layer_name)
 
     def log_receive(self, binary, ip, port):
-        logger.trace("Trying to read %d bytes: %s from %s:%s over %s" % (
-            len(binary), to_hex(binary), ip, port, self._transport_layer_name))
+        # Received data may be a view to the receive buffer, so it can not
+        # be formatted later.
+        if logger.is_enabled('TRACE'):
+            logger.trace("Trying to read %d bytes: %s from %s:%s over %s" % (
+                len(binary), to_hex(binary), ip, port, self._transport_layer_name))
 
     def empty(self):
         result = True
@@ -130,6 +160,20 @@ class _NetworkNode(_WithTimeouts, metaclass=SynchronizedType):
         self.log_receive(msg, ip, port)
         return msg, ip, port
 
+    def receive_into(self, buffer, timeout=None, alias=None):
+        """Receives data directly into writable `buffer` and returns the
+        number of bytes received."""
+        self._raise_error_if_alias_given(alias)
+        timeout = self._get_timeout(timeout)
+        self._socket.settimeout(timeout)
+        return self._receive_into_ip_port(buffer)[0]
+
+    def _receive_into_ip_port(self, buffer):
+        size = self._socket.recv_into(buffer)
+        ip, port = self._socket.getpeername()[:2]
+        self.log_receive(buffer[:size], ip, port)
+        return size, ip, port
+
     def send(self, msg, alias=None):
         self._raise_error_if_alias_given(alias)
         ip, port = self.get_peer_address()
@@ -139,6 +183,18 @@ class _NetworkNode(_WithTimeouts, metaclass=SynchronizedType):
     def _sendall(self, msg):
         self._socket.sendall(msg)
 
+    def send_messages(self, msgs, alias=None):
+        """Sends all `msgs`. Over TCP they are sent with one call."""
+        self._raise_error_if_alias_given(alias)
+        ip, port = self.get_peer_address()
+        for msg in msgs:
+            self.log_send(msg, ip, port)
+        if self._joins_messages:
+            self._sendall(b''.join(msgs))
+        else:
+            for msg in msgs:
+                self._sendall(msg)
+
     def _raise_error_if_alias_given(self, alias):
         if alias:
             raise AssertionError('Connection aliases not supported.')
@@ -153,6 +209,7 @@ class _NetworkNode(_WithTimeouts, metaclass=SynchronizedType):
 
 class _TCPNode(object):
     _transport_layer_name = 'TCP'
+    _joins_messages = True
     _size_limit = TCP_BUFFER_SIZE
 
     def _init_socket(self, family):
@@ -162,6 +219,7 @@ class _TCPNode(object):
 
 class _UDPNode(object):
     _transport_layer_name = 'UDP'
+    _joins_messages = False
     _size_limit = UDP_BUFFER_SIZE
 
     def _init_socket(self, family):
@@ -171,6 +229,7 @@ class _UDPNode(object):
 
 class _SCTPNode(object):
     _transport_layer_name = 'SCTP'
+    _joins_messages = False
     _size_limit = TCP_BUFFER_SIZE
 
     def _init_socket(self, family):
@@ -212,6 +271,13 @@ class UDPServer(_Server, _UDPNode):
         self._last_client = (ip, int(port))
         return msg, ip, port
 
+    def _receive_into_ip_port(self, buffer):
+        size, address = self._socket.recvfrom_into(buffer)
+        ip, port = address[:2]
+        self.log_receive(buffer[:size], ip, port)
+        self._last_client = (ip, int(port))
+        return size, ip, port
+
     def _check_no_alias(self, alias):
         if alias:
             raise Exception('Connection aliases are not supported on UDP Servers')
@@ -263,6 +329,10 @@ class StreamServer(_Server):
         connection = self._connections.get(alias)
         connection.send(msg)
 
+    def send_messages(self, msgs, alias=None):
+        connection = self._connections.get(alias)
+        connection.send_messages(msgs)
+
     def send_to(self, *args):
         raise Exception("Stream server cannot send to a specific address.")
 
@@ -277,9 +347,17 @@ class StreamServer(_Server):
     def close_connection(self, alias=None):
         raise Exception("Not yet implemented")
 
-    def get_message(self, message_template, timeout=None, alias=None, header_filter=None):
+    def get_message(self, message_template, timeout=None, alias=None, header_filter=None, latest=None, lazy=None):
         connection = self._connections.get(alias)
-        return connection.get_message(message_template, timeout=timeout, header_filter=header_filter)
+        with released(self):
+            return connection.get_message(message_template, timeout=timeout, header_filter=header_filter,
+                                          latest=latest, lazy=lazy)
+
+    def get_messages(self, message_template, count, timeout=None, alias=None, header_filter=None, latest=None,
+                     lazy=None):
+        connection = self._connections.get(alias)
+        return connection.get_messages(message_template, count, timeout=timeout, header_filter=header_filter,
+                                       latest=latest, lazy=lazy)
 
     def empty(self):
         for connection in self._connections:
@@ -392,41 +470,118 @@ class _NamedCache(object):
 
 
 class BufferedStream(_WithTimeouts):
+    """Buffers received bytes in a `bytearray`.
+
+    Unread data lives in `self._buffer[self._start:self._end]`. Reading
+    advances `self._start` and the data is moved to the beginning of the
+    buffer only when there is not enough room for the next receive.
+    """
+    _read_size = UDP_BUFFER_SIZE
 
     def __init__(self, connection, default_timeout):
         self._connection = connection
-        self._buffer = ''
         self._default_timeout = default_timeout
+        # Held by the thread reading a message from the stream.
+        self.lock = threading.RLock()
+        # True when the latest receive got no data because the peer has
+        # closed the connection.
+        self.eof = False
+        self.empty()
+
+    def fileno(self):
+        return self._connection.fileno()
+
+    @property
+    def default_timeout(self):
+        return self._default_timeout
 
     def read(self, size, timeout=None):
-        result = ''
         timeout = float(timeout if timeout else self._default_timeout)
         cutoff = time.time() + timeout
         while time.time() < cutoff:
-            result += self._get(size - len(result))
-            if self._size_full(result, size):
-                return result
+            if self._size_full(size):
+                return self._get(size)
             self._fill_buffer(timeout)
         raise AssertionError('Timeout %fs exceeded.' % timeout)
 
-    def _size_full(self, result, size):
-        return len(result) == size or (size == -1 and len(result))
+    def read_frame(self, header_length, get_frame_length, timeout=None):
+        """Reads one whole message. `get_frame_length` is called with the
+        first `header_length` bytes and returns the length of the message."""
+        timeout = float(timeout if timeout else self._default_timeout)
+        cutoff = time.time() + timeout
+        while time.time() < cutoff:
+            size = self._buffered_frame_length(header_length, get_frame_length)
+            if size is not None and self._size_full(size):
+                return self._get(size)
+            self._fill_buffer(timeout)
+        raise AssertionError('Timeout %fs exceeded.' % timeout)
+
+    def read_frames(self, header_length, get_frame_length):
+        """Returns all whole messages currently in the buffer."""
+        frames = []
+        while True:
+            size = self._buffered_frame_length(header_length, get_frame_length)
+            if size is None or not self._size_full(size):
+                return frames
+            frames.append(self._get(size))
+
+    def _buffered_frame_length(self, header_length, get_frame_length):
+        if not self._size_full(header_length):
+            return None
+        return get_frame_length(bytes(self._buffer[self._start:self._start + header_length]))
+
+    @property
+    def available(self):
+        return self._end - self._start
+
+    def _size_full(self, size):
+        return self.available >= size if size != -1 else self.available > 0
 
     def return_data(self, data):
-        if data:
-            self._buffer = data + self._buffer
+        if not data:
+            return
+        size = len(data)
+        if size <= self._start:
+            self._start -= size
+            self._buffer[self._start:self._start + size] = data
+        else:
+            self._buffer = bytearray(data) + self._buffer[self._start:self._end]
+            self._start, self._end = 0, len(self._buffer)
 
     def _get(self, size):
         if size == -1:
-            size = len(self._buffer)
-        if not self._buffer:
-            return ''
-        result = self._buffer[:size]
-        self._buffer = self._buffer[size:]
+            size = self.available
+        result = bytes(memoryview(self._buffer)[self._start:self._start + size])
+        self._start += size
+        if self._start == self._end:
+            self._start = self._end = 0
         return result
 
     def _fill_buffer(self, timeout):
-        self._buffer += self._connection.receive(timeout=timeout)
+        self._make_room()
+        view = memoryview(self._buffer)[self._end:]
+        try:
+            received = self._connection.receive_into(view, timeout=timeout)
+            self.eof = not received
+            self._end += received
+        finally:
+            # Released explicitly so that a traceback referring to the view
+            # does not prevent resizing the buffer later.
+            view.release()
+
+    def _make_room(self):
+        if len(self._buffer) - self._end >= self._read_size:
+            return
+        if self._start:
+            self._buffer[:self.available] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, self.available
+        missing = self._read_size - (len(self._buffer) - self._end)
+        if missing > 0:
+            self._buffer.extend(bytes(missing))
 
     def empty(self):
-        self._buffer = ''
+        self._buffer = bytearray()
+        self._start = self._end = 0
+
+    def close(self):
+        self.empty()
@@ -60,7 +60,13 @@ class Rammbock(RammbockCore):
     |                 | ${msg} = | `Server receives message` |
     |                 | Should be equal | ${msg.status.hex} | ${status} |
 
+    Messages logged by handlers running on background are kept until `Log
+    Handler Messages` is called. Only the latest `handler_log_capacity`
+    messages of every thread are kept, 10000 by default, and the count of
+    dropped older messages is logged with them.
 
+    | *Settings * |
+    | Library     | Rammbock | handler_log_capacity=1000 |
     """
 
     ROBOT_LIBRARY_VERSION = VERSION
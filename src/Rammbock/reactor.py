@@ -0,0 +1,152 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import selectors
+import socket
+import threading
+import time
+import traceback
+
+from .logger import logger
+
+
+class Reactor(object):
+    """Runs message handlers of all message streams in one thread.
+
+    Streams are registered with the file descriptor of their connection.
+    The reactor thread waits until any of the connections is readable and
+    calls `match_handlers(readable=True)` of the stream. Every stream is
+    also checked at least once per its interval with `readable=False`, so
+    that messages already received by other keywords get handled. If the
+    peer has closed a readable connection, `match_handlers` returns False
+    and the connection is only checked once per interval until it gives
+    messages again. A connection holding only part of a message is not
+    muted. `match_handlers` returns None if another thread is receiving
+    from the connection, which does not mute it either.
+
+    Registrations are passed to the reactor thread through a queue, so that
+    the selector is only used from that thread.
+    """
+
+    def __init__(self):
+        self._selector = None
+        self._streams = {}
+        self._changes = []
+        self._changes_lock = threading.Lock()
+        self._thread = None
+        self._wakeup = None
+
+    def register(self, stream, fileno, interval):
+        self._change(self._register, stream, fileno, float(interval))
+
+    def unregister(self, stream):
+        self._change(self._unregister, stream)
+
+    def _change(self, change, *args):
+        with self._changes_lock:
+            self._changes.append((change, args))
+            if not self._thread:
+                self._start()
+        self._wakeup[1].send(b'\x00')
+
+    def _start(self):
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = socket.socketpair()
+        self._wakeup[0].setblocking(False)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name="Background handler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._run_once()
+            except Exception:
+                logger.debug("failure in background handler %s" % traceback.format_exc())
+
+    def _run_once(self):
+        self._apply_changes()
+        ready = set(key.data for key, _ in self._selector.select(self._get_timeout()))
+        now = time.time()
+        for stream, registration in list(self._streams.items()):
+            readable = stream in ready
+            if readable or now >= registration.deadline:
+                registration.deadline = now + registration.interval
+                is_open = self._match_handlers(stream, readable)
+                self._set_muted(registration, readable and is_open is False)
+
+    def _apply_changes(self):
+        try:
+            while self._wakeup[0].recv(1024):
+                pass
+        except BlockingIOError:
+            pass
+        with self._changes_lock:
+            changes, self._changes = self._changes, []
+        for change, args in changes:
+            change(*args)
+
+    def _register(self, stream, fileno, interval):
+        if stream in self._streams:
+            self._unregister(stream)
+        registration = _Registration(stream, fileno, interval)
+        try:
+            self._selector.register(fileno, selectors.EVENT_READ, stream)
+        except (ValueError, KeyError, OSError):
+            logger.debug("Can not handle messages of closed connection %s" % traceback.format_exc())
+            return
+        self._streams[stream] = registration
+
+    def _unregister(self, stream):
+        if stream in self._streams:
+            self._set_muted(self._streams.pop(stream), True)
+
+    def _set_muted(self, registration, muted):
+        if muted == registration.muted:
+            return
+        try:
+            if muted:
+                self._selector.unregister(registration.fileno)
+            else:
+                self._selector.register(registration.fileno, selectors.EVENT_READ, registration.stream)
+            registration.muted = muted
+        except (ValueError, KeyError, OSError):
+            pass
+
+    def _get_timeout(self):
+        if not self._streams:
+            return None
+        deadline = min(registration.deadline for registration in self._streams.values())
+        return max(deadline - time.time(), 0)
+
+    def _match_handlers(self, stream, readable):
+        try:
+            return stream.match_handlers(readable)
+        except Exception:
+            logger.debug("failure in matching handlers %s" % traceback.format_exc())
+            return False
+
+
+class _Registration(object):
+
+    def __init__(self, stream, fileno, interval):
+        self.stream = stream
+        self.fileno = fileno
+        self.interval = interval
+        self.deadline = time.time() + interval
+        self.muted = False
+
+
+REACTOR = Reactor()
@@ -16,14 +16,31 @@ try:
     from collections import OrderedDict
 except ImportError:  # New in 2.7 but 2.4 compatible recipe would be available.
     OrderedDict = dict
+from collections import deque
+import logging
 import threading
 import time
 
 from robot.api import logger
 
 
+# Robot Framework sets the level of the root logger of the logging module
+# to match its own log level.
+LEVELS = {'TRACE': logging.NOTSET,
+          'DEBUG': logging.DEBUG,
+          'INFO': logging.INFO,
+          'HTML': logging.INFO,
+          'WARN': logging.WARNING,
+          'ERROR': logging.ERROR}
+
+
 class Logger(object):
 
+    def is_enabled(self, level):
+        """Returns True if messages with `level` are written with the current
+        Robot Framework log level."""
+        return LEVELS.get(level.upper(), logging.INFO) >= logging.getLogger().getEffectiveLevel()
+
     def trace(self, msg, html=False):
         self.write(msg, 'TRACE', html)
 
@@ -37,24 +54,51 @@ class Logger(object):
         self.write(msg, 'WARN', html)
 
     def write(self, msg, level, html=False):
-        logger.write(msg, level, html)
+        if self.is_enabled(level):
+            logger.write(msg, level, html)
 
 
 class BackgroundLogger(Logger):
+    """Logger that stores messages written by background threads.
+
+    Every thread has its own buffer, which keeps at most `capacity` latest
+    messages and counts the dropped ones. Writing only appends to the
+    buffer of the current thread without locking, and messages are
+    formatted when they are forwarded to Robot Framework log.
+    """
     LOGGING_THREADS = logger.librarylogger.LOGGING_THREADS
 
-    def __init__(self):
+    def __init__(self, capacity=10000):
         self.lock = threading.RLock()
+        self.capacity = int(capacity)
         self._messages = OrderedDict()
+        self._local = threading.local()
 
     def write(self, msg, level, html=False):
+        thread = threading.current_thread().name
+        if thread in self.LOGGING_THREADS:
+            Logger.write(self, msg, level, html)
+        elif self.is_enabled(level):
+            self._get_buffer(thread).append(BackgroundMessage(msg, level, html))
+
+    def _get_buffer(self, thread):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.removed or buffer.thread != thread or buffer.capacity != self.capacity:
+            with self.lock:
+                buffer = self._messages.get(thread)
+                if buffer is None or buffer.capacity != self.capacity:
+                    buffer = self._messages[thread] = _MessageBuffer(thread, self.capacity, buffer)
+                # Threads with the same name share the buffer. It is
+                # removed after the latest of them has finished.
+                buffer.owner = threading.current_thread()
+            self._local.buffer = buffer
+        return buffer
+
+    def set_capacity(self, capacity):
+        """Sets how many latest messages are kept per thread. Already stored
+        messages over the new capacity are dropped."""
         with self.lock:
-            thread = threading.currentThread().getName()
-            if thread in self.LOGGING_THREADS:
-                Logger.write(self, msg, level, html)
-            else:
-                message = BackgroundMessage(msg, level, html)
-                self._messages.setdefault(thread, []).append(message)
+            self.capacity = int(capacity)
 
     def log_background_messages(self, name=None):
         """Forwards messages logged on background to Robot Framework log.
@@ -71,21 +115,79 @@ class BackgroundLogger(Logger):
                 self._log_all_messages()
 
     def _log_messages_by_thread(self, name):
-        for message in self._messages.pop(name, []):
-            print(message.format())
+        buffer = self._messages.get(name)
+        if buffer:
+            self._log_messages(buffer)
 
     def _log_all_messages(self):
-        for thread in list(self._messages):
-            print("*HTML* <b>Messages by '%s'</b>" % thread)
-            for message in self._messages.pop(thread):
-                print(message.format())
+        for buffer in list(self._messages.values()):
+            if buffer.has_messages():
+                print("*HTML* <b>Messages by '%s'</b>" % buffer.thread)
+                self._log_messages(buffer)
+            else:
+                self._take(buffer)
+
+    def _log_messages(self, buffer):
+        dropped, messages = self._take(buffer)
+        if dropped:
+            print("*INFO* %d older messages were dropped." % dropped)
+        for message in messages:
+            print(message.format())
 
     def reset_background_messages(self, name=None):
         with self.lock:
             if name:
-                self._messages.pop(name)
+                self._take(self._messages[name])
             else:
-                self._messages.clear()
+                for buffer in list(self._messages.values()):
+                    self._take(buffer)
+
+    def _take(self, buffer):
+        # Buffers of finished threads are removed once they are empty.
+        finished = not buffer.owner.is_alive()
+        result = buffer.take()
+        if finished:
+            buffer.removed = True
+            self._messages.pop(buffer.thread, None)
+        return result
+
+
+class _MessageBuffer(object):
+    """Ring buffer of one thread. Only that thread appends to it, so the
+    count of dropped messages is not exact if messages are taken at the
+    same time."""
+
+    def __init__(self, thread, capacity, previous=None):
+        self.thread = thread
+        self.capacity = capacity
+        self.owner = None
+        self.removed = False
+        self.dropped = 0
+        self._messages = deque(maxlen=capacity)
+        if previous:
+            self.dropped, messages = previous.take()
+            for message in messages:
+                self.append(message)
+
+    def append(self, message):
+        if len(self._messages) == self.capacity:
+            self.dropped += 1
+        self._messages.append(message)
+
+    def has_messages(self):
+        return bool(self._messages or self.dropped)
+
+    def take(self):
+        """Removes and returns count of dropped messages and the stored
+        messages."""
+        messages = []
+        while True:
+            try:
+                messages.append(self._messages.popleft())
+            except IndexError:
+                break
+        dropped, self.dropped = self.dropped, 0
+        return dropped, messages
 
 
 class BackgroundMessage(object):
@@ -101,3 +203,15 @@ class BackgroundMessage(object):
         html = self.html and self.level == 'INFO'
         level = self.level if not html else 'HTML'
         return "*%s:%d* %s" % (level, round(self.timestamp), self.message)
+
+
+class Deferred(object):
+    """Message that is created by calling `function` with `args` only when
+    it is written to the log."""
+
+    def __init__(self, function, *args):
+        self._function = function
+        self._args = args
+
+    def __str__(self):
+        return str(self._function(*self._args))
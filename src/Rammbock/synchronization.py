@@ -1,15 +1,82 @@
+from contextlib import contextmanager
 import threading
 
 from .decorator import decorator
 
 
+# Guards creating the locks of the instances. Each synchronized instance
+# has its own lock, so that operations on different nodes do not wait for
+# each other.
 LOCK = threading.RLock()
 
 
+class InstanceLock(object):
+    """Reentrant lock that can be released for the duration of a wait.
+
+    Works like `threading.RLock`, but `released()` gives the lock away
+    completely, however many times the current thread has entered it, and
+    takes it back afterwards.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owner = None
+        self._count = 0
+
+    def __reduce__(self):
+        # Copies of the locked object, for example templates deep copied
+        # with a reference to the library, get a new lock of their own.
+        return InstanceLock, ()
+
+    def __enter__(self):
+        me = threading.get_ident()
+        if self._owner != me:
+            self._lock.acquire()
+            self._owner = me
+        self._count += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._count -= 1
+        if not self._count:
+            self._owner = None
+            self._lock.release()
+
+    @contextmanager
+    def released(self):
+        me = threading.get_ident()
+        if self._owner != me:
+            yield
+            return
+        count = self._count
+        self._owner, self._count = None, 0
+        self._lock.release()
+        try:
+            yield
+        finally:
+            self._lock.acquire()
+            self._owner, self._count = me, count
+
+
+def get_lock(obj):
+    """Returns the lock of `obj`, creating it on first use."""
+    try:
+        return obj.__dict__['_instance_lock']
+    except KeyError:
+        with LOCK:
+            return obj.__dict__.setdefault('_instance_lock', InstanceLock())
+
+
+def released(obj):
+    """Context manager releasing the lock of `obj` while waiting for
+    something that other threads using `obj` may need to do."""
+    return get_lock(obj).released()
+
+
 @decorator
 def synchronized(f, *args, **kw):
     """ Synchronization decorator """
-    with LOCK:
+    with get_lock(args[0]):
         return f(*args, **kw)
 
 
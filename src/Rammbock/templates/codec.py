@@ -0,0 +1,114 @@
+#  Copyright 2014 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import copy
+import struct
+
+from Rammbock.message import Field, BinaryField
+
+
+def compile_fields(fields):
+    """Returns decoding plan for `fields`.
+
+    Consecutive statically sized primitives are grouped to `StaticRun`s,
+    which decode the whole block with one `struct.Struct` call. Other fields
+    are left as they are and decoded by the field itself.
+    """
+    plan, run = [], []
+    for field in fields:
+        if field.has_static_layout:
+            run.append(field)
+            continue
+        if run:
+            plan.append(StaticRun(run))
+            run = []
+        plan.append(field)
+    if run:
+        plan.append(StaticRun(run))
+    return plan
+
+
+class StaticRun(object):
+    """Consecutive statically sized fields decoded with one `struct` call.
+
+    Runs are only used for decoding. Encoding resolves the value of every
+    field separately, because each message can override them, and the
+    encoded fields write themselves to the message buffer.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._lengths = [field.length.decode_lengths(None) for field in fields]
+        self._struct = struct.Struct('>' + ''.join(self._format(length, aligned)
+                                                   for length, aligned in self._lengths))
+        self.size = self._struct.size
+
+    def get_offsets(self, offset=0):
+        """Returns offsets of the fields in this run starting from `offset`."""
+        offsets = {}
+        for field, (_, aligned_length) in zip(self.fields, self._lengths):
+            offsets[field.name] = offset
+            offset += aligned_length
+        return offsets
+
+    def _format(self, length, aligned_length):
+        padding = aligned_length - length
+        return '%ds%dx' % (length, padding) if padding else '%ds' % length
+
+    def decode(self, data, offset, message, little_endian=False):
+        """Decodes run from `data` starting at `offset` and adds the fields
+        to `message`. Returns the offset after the run.
+        """
+        if len(data) - offset < self.size:
+            return self._decode_field_by_field(data, offset, message, little_endian)
+        values = self._struct.unpack_from(data, offset)
+        for field, value, (_, aligned_length) in zip(self.fields, values, self._lengths):
+            message[field.name] = Field(field.type, field._get_name(), value,
+                                        aligned_len=aligned_length,
+                                        little_endian=little_endian and field.can_be_little_endian)
+        return offset + self.size
+
+    def _decode_field_by_field(self, data, offset, message, little_endian):
+        # Not enough data. Let the fields report which one is missing.
+        for field in self.fields:
+            message[field.name] = field.decode(data[offset:], message, little_endian=little_endian)
+            offset += len(message[field.name])
+        return offset
+
+    def __deepcopy__(self, memo):
+        return StaticRun(copy.deepcopy(self.fields, memo))
+
+
+class BitFields(object):
+    """Decodes binary fields of a binary container.
+
+    The container is read as one integer and every field is taken from it
+    with a shift and a mask calculated here once.
+    """
+
+    def __init__(self, fields):
+        binlength = sum(field.length.value for field in fields)
+        self.size = binlength // 8
+        self._fields = []
+        for field in fields:
+            bits = field.length.value
+            binlength -= bits
+            self._fields.append((field.name, bits, binlength, (1 << bits) - 1))
+
+    def decode(self, data, container, little_endian=False):
+        value = int.from_bytes(data[:self.size], 'little' if little_endian else 'big')
+        for name, bits, shift, mask in self._fields:
+            field_value = (value >> shift) & mask
+            container[name] = BinaryField(bits, name, field_value.to_bytes(
+                max((field_value.bit_length() + 7) // 8, 1), 'big'))
@@ -16,27 +16,29 @@ from math import ceil
 import re
 
 from Rammbock.message import (Field, Union, Message, Header, List, Struct,
-                              BinaryContainer, BinaryField, TBCDContainer,
-                              Conditional, Bag)
+                              BinaryContainer, TBCDContainer,
+                              Conditional, Bag, LazyMessage)
+from .codec import compile_fields, StaticRun, BitFields
 from .message_stream import MessageStream
-from .primitives import Length, Binary, TBCD, BagSize
-from Rammbock.ordered_dict import OrderedDict
-from Rammbock.binary_tools import (to_binary_string_of_length, to_bin,
-                                   to_tbcd_value, to_tbcd_binary)
+from .primitives import Length, Binary, TBCD, BagSize, shared_expected_values
+from Rammbock.binary_tools import to_tbcd_digits
 from Rammbock.condition_parser import ConditionParser
 from Rammbock.logger import logger
 
 
 class _Template(object):
 
+    has_static_layout = False
+
     def __init__(self, name, parent):
         self.parent = parent
-        self._fields = OrderedDict()
+        self._fields = {}
         self.name = name
         self._saved = False
+        self._codec = None
 
     def _pretty_print_fields(self, fields):
-        return ', '.join('%s:%s' % (key, value) for key, value in list(fields.items()))
+        return ', '.join('%s:%s' % (key, value) for key, value in fields.items())
 
     def _mark_referenced_field(self, field):
         ref_field = self._get_field_recursive(field.length.field)
@@ -52,6 +54,7 @@ class _Template(object):
         if field.has_length and field.length.has_references:
             self._mark_referenced_field(field)
         self._fields[field.name] = field
+        self._codec = None
 
     def _handle_pdu_field(self, field):
         raise AssertionError('PDU field not allowed')
@@ -87,7 +90,7 @@ class _Template(object):
         return (self.parent._get_recursive_name() + "." if self.parent else '') + self.name
 
     def _encode_fields(self, struct, params, little_endian=False):
-        for field in list(self._fields.values()):
+        for field in self._fields.values():
             encoded = field.encode(params, struct, little_endian=little_endian)
             # TODO: clean away this ugly hack that makes it possible to skip PDU
             # (now it is a 0 length place holder in header)
@@ -97,15 +100,52 @@ class _Template(object):
 
     def decode(self, data, parent=None, name=None, little_endian=False):
         message = self._get_struct(name, parent)
-        data_index = 0
-        for field in list(self._fields.values()):
-            message[field.name] = field.decode(data[data_index:], message, little_endian=little_endian)
-            data_index += len(message[field.name])
+        self._decode_fields(data, message, little_endian=little_endian)
         return message
 
+    def _decode_fields(self, data, message, little_endian=False):
+        data = memoryview(data)
+        data_index = 0
+        for field in self._get_decoding_plan():
+            if isinstance(field, StaticRun):
+                data_index = field.decode(data, data_index, message, little_endian=little_endian)
+            elif field.type != 'pdu':
+                message[field.name] = field.decode(data[data_index:], message, little_endian=little_endian)
+                data_index += len(message[field.name])
+        return data_index
+
+    def _get_decoding_plan(self):
+        if self._codec is None:
+            return self._fields.values()
+        return self._codec
+
+    def _get_static_offsets(self):
+        """Returns offsets of the fields whose position does not depend on
+        the decoded data."""
+        offsets, offset = {}, 0
+        for field in self._get_decoding_plan():
+            if not isinstance(field, StaticRun):
+                offsets[field.name] = offset
+                break
+            offsets.update(field.get_offsets(offset))
+            offset += field.size
+        return offsets
+
+    def compile(self):
+        """Precompiles decoding of this template and its sub templates.
+
+        Runs of statically sized fields are decoded with a single
+        `struct.Struct` call afterwards. Adding a field invalidates the
+        compiled plan.
+        """
+        for field in self._fields.values():
+            if isinstance(field, _Template):
+                field.compile()
+        self._codec = compile_fields(self._fields.values())
+
     def validate(self, message, message_fields):
         errors = []
-        for field in list(self._fields.values()):
+        for field in self._fields.values():
             errors += field.validate(message, message_fields)
         self._check_params_empty(message_fields, self.name)
         return errors
@@ -140,7 +180,7 @@ class Protocol(_Template):
 
     def header_length(self):
         try:
-            return sum(field.get_static_length() for field in list(self._fields.values()) if field.type != 'pdu')
+            return sum(field.get_static_length() for field in self._fields.values() if field.type != 'pdu')
         except IndexError:
             return -1
 
@@ -149,7 +189,7 @@ class Protocol(_Template):
         header = Header(self.name)
         self._encode_fields(header, header_params, little_endian=self.little_endian)
         if self.pdu_length:
-            self.pdu_length.find_length_and_set_if_necessary(header, len(list(message._get_raw_bytes())), little_endian=self.little_endian)
+            self.pdu_length.find_length_and_set_if_necessary(header, len(message), little_endian=self.little_endian)
         return header
 
     def _handle_pdu_field(self, field):
@@ -167,20 +207,69 @@ class Protocol(_Template):
         _Template.add(self, field)
 
     # TODO: fields after the pdu
-    def _extract_values_from_data(self, data, header, values):
-        data_index = 0
-        for field in values:
-            if field is not self.pdu:
-                header[field.name] = field.decode(data[data_index:], header, little_endian=self.little_endian)
-                data_index += len(header[field.name])
+    def _extract_values_from_data(self, data, header):
+        data_index = self._decode_fields(data, header, little_endian=self.little_endian)
         return data[data_index:]
 
     def read(self, stream, timeout=None):
-        # TODO: use all data if length cannot be obtained. Return amount of data
-        # used to stream
-        data = stream.read(self.header_length(), timeout=timeout)
+        header_length = self.header_length()
+        if header_length < 0:
+            return self._read_header_and_pdu(stream, timeout)
+        frame = stream.read_frame(header_length, self.get_frame_length, timeout=timeout)
+        return self._split_frame(frame, header_length)
+
+    def read_buffered(self, stream):
+        """Returns all complete messages already buffered in `stream`
+        without waiting for more data."""
+        header_length = self.header_length()
+        if header_length < 0:
+            return []
+        return [self._split_frame(frame, header_length)
+                for frame in stream.read_frames(header_length, self.get_frame_length)]
+
+    def get_frame_length(self, header_data):
+        """Returns the length of a whole message from its header bytes."""
+        header_length = len(header_data)
+        if not self.pdu:
+            return header_length
+        if self.pdu_length.static:
+            return header_length + self.pdu_length.value
+        return header_length + self.pdu_length.calc_value(self._get_length_value(header_data))
+
+    def compile(self):
+        """Precompiles decoding of the header and finds the offset of the
+        PDU length field, if its position does not depend on the data."""
+        _Template.compile(self)
+        self._length_field = None
+        if self.pdu and not self.pdu_length.static:
+            field = self._get_field(self.pdu_length.field)
+            offset = self._get_static_offsets().get(self.pdu_length.field)
+            if offset is not None and field.has_static_layout:
+                self._length_field = (offset, offset + field.length.value, field.type == 'int')
+
+    def _get_length_value(self, header_data):
+        if self._codec is None:
+            self.compile()
+        if self._length_field is None:
+            header = Header(self.name)
+            self._extract_values_from_data(header_data, header)
+            return header[self.pdu_length.field].int
+        start, end, signed = self._length_field
+        return int.from_bytes(header_data[start:end], 'little' if self.little_endian else 'big',
+                              signed=signed)
+
+    def _split_frame(self, frame, header_length):
         header = Header(self.name)
-        unused_data = self._extract_values_from_data(data, header, list(self._fields.values()))
+        self._extract_values_from_data(frame[:header_length], header)
+        pdu_bytes = bytes(frame[header_length:]) if self.pdu else None
+        return header, pdu_bytes
+
+    def _read_header_and_pdu(self, stream, timeout):
+        # Header length is not static, so all available data is read
+        # and the part that was not used by the header is given back.
+        data = stream.read(-1, timeout=timeout)
+        header = Header(self.name)
+        unused_data = self._extract_values_from_data(data, header)
         stream.return_data(unused_data)
         pdu_bytes = None
         if self.pdu:
@@ -188,8 +277,7 @@ class Protocol(_Template):
                 length = self.pdu_length.value
             else:
                 length = self.pdu_length.calc_value(header[self.pdu_length.field].int)
-            # TODO: we need a timeout?
-            pdu_bytes = stream.read(length)
+            pdu_bytes = stream.read(length, timeout=timeout)
         return header, pdu_bytes
 
     def get_message_stream(self, buffered_stream):
@@ -205,7 +293,9 @@ class MessageTemplate(_Template):
         self._protocol = protocol
         self.header_parameters = header_params
 
-    def decode(self, data, parent=None, name=None, little_endian=False):
+    def decode(self, data, parent=None, name=None, little_endian=False, lazy=False):
+        if lazy:
+            return LazyMessage(self.name, _LazyDecoder(self, data, little_endian))
         msg = _Template.decode(self, data, parent, name, little_endian)
         self.check_message_lengths(msg, data)
         return msg
@@ -249,6 +339,17 @@ class MessageTemplate(_Template):
         validation_params.update(header_fields)
         return self._protocol.validate(message._header, validation_params) + _Template.validate(self, message, message_fields)
 
+    def get_validator(self, message_fields, header_fields):
+        """Returns a function validating many messages against the same
+        field values. Expected values are encoded only for the first message
+        and shared with the rest."""
+        expected_values = {}
+
+        def validate(message):
+            with shared_expected_values(expected_values):
+                return self.validate(message, message_fields.copy(), header_fields.copy())
+        return validate
+
     def set_as_saved(self):
         self._saved = True
 
@@ -257,6 +358,36 @@ class MessageTemplate(_Template):
         return not bool(self._protocol.pdu)
 
 
+class _LazyDecoder(object):
+
+    def __init__(self, template, data, little_endian=False):
+        self._template = template
+        self._data = data
+        self._little_endian = little_endian
+        self._offsets = template._get_static_offsets()
+
+    def has_field(self, name):
+        return name in self._template._fields
+
+    def decode_field(self, message, name):
+        if name not in self._offsets:
+            # Position depends on preceding dynamic fields, so the whole
+            # message has to be decoded anyway.
+            message._fields
+            return
+        field = self._template._fields[name]
+        message[name] = field.decode(memoryview(self._data)[self._offsets[name]:],
+                                     message, little_endian=self._little_endian)
+
+    def decode_all(self, message):
+        header = message._decoded.get('_header')
+        message._decoded = {}
+        if header:
+            message._decoded['_header'] = header
+        self._template._decode_fields(self._data, message, little_endian=self._little_endian)
+        self._template.check_message_lengths(message, self._data)
+
+
 class StructTemplate(_Template):
 
     has_length = False
@@ -274,12 +405,12 @@ class StructTemplate(_Template):
         self.length = Length(length)
 
     def get_static_length(self):
-        return sum(field.get_static_length() for field in list(self._fields.values()))
+        return sum(field.get_static_length() for field in self._fields.values())
 
     def decode(self, data, parent=None, name=None, little_endian=False):
         if self.has_length:
             length = self.length.decode(parent)
-            data = data[:length]
+            data = memoryview(data)[:length]
         return _Template.decode(self, data, parent, name, little_endian)
 
     def encode(self, message_params, parent=None, name=None, little_endian=False):
@@ -329,11 +460,11 @@ class UnionTemplate(_Template):
         self._fields[field.name] = field
 
     def get_static_length(self):
-        return max(field.get_static_length() for field in list(self._fields.values()))
+        return max(field.get_static_length() for field in self._fields.values())
 
     def decode(self, data, parent=None, name=None, little_endian=False):
         union = self._get_struct(name, parent)
-        for field in list(self._fields.values()):
+        for field in self._fields.values():
             union[field.name] = field.decode(data, union, little_endian=little_endian)
         return union
 
@@ -380,13 +511,14 @@ class BagTemplate(_Template):
 
     def decode(self, data, parent=None, name=None, little_endian=False):
         bag = self._get_struct(name, parent)
+        data = memoryview(data)
         while data:
             match = self._decode_one(data, bag, little_endian=little_endian)
             data = data[len(match['0']):]
         return bag
 
     def _decode_one(self, data, bag, little_endian=False):
-        for case in list(self._fields.values()):
+        for case in self._fields.values():
             try:
                 match = case.decode(data, bag, little_endian=little_endian)
                 logger.trace("'%s' matches in bag '%s'. value: %r" % (case.name, self.name, match[match.len - 1]))
@@ -398,7 +530,7 @@ class BagTemplate(_Template):
     def _get_struct(self, name, parent):
         bag = Bag(name or self.name)
         bag._parent = parent
-        for case in list(self._fields.values()):
+        for case in self._fields.values():
             bag[case.name] = case.get_message_object(bag)
         return bag
 
@@ -407,7 +539,7 @@ class BagTemplate(_Template):
         params_subtree = self._get_params_sub_tree(message_fields, name)
         bag = parent[name]
         errors = []
-        for field in list(self._fields.values()):
+        for field in self._fields.values():
             errors += field.validate(bag, params_subtree)
         return errors
 
@@ -423,7 +555,7 @@ class CaseTemplate(_Template):
 
     @property
     def field(self):
-        return list(self._fields.values())[0]
+        return next(iter(self._fields.values()))
 
     def add(self, field):
         self.name = field.name
@@ -488,7 +620,7 @@ class ListTemplate(_Template):
 
     @property
     def field(self):
-        return list(self._fields.values())[0]
+        return next(iter(self._fields.values()))
 
     def _get_struct(self, name=None, parent=None):
         ls = List(name or self.name, self.field.type)
@@ -498,6 +630,7 @@ class ListTemplate(_Template):
     def decode(self, data, parent, name=None, little_endian=False):
         name = name or self.name
         message = self._get_struct(name, parent)
+        data = memoryview(data)
         data_index = 0
         # maximum_length is given for free length (*) to limit the absolute maximum number of entries
         for index in range(0, self.length.decode(parent, maximum_length=len(data))):
@@ -518,7 +651,7 @@ class ListTemplate(_Template):
         return errors
 
     def _get_params_sub_tree(self, params, name=None):
-        result = OrderedDict({'*': params['*']} if '*' in params else {})
+        result = {'*': params['*']} if '*' in params else {}
         name = name or self.name
         for key in list(params.keys()):
             self._consume_params_with_brackets(name, params, result, key)
@@ -548,7 +681,7 @@ class BinaryContainerTemplate(_Template):
     type = 'BinaryContainer'
 
     def get_static_length(self):
-        return self.binlength / 8
+        return self.binlength // 8
 
     def add(self, field):
         if not isinstance(field, Binary):
@@ -557,7 +690,7 @@ class BinaryContainerTemplate(_Template):
 
     @property
     def binlength(self):
-        return sum(field.length.value for field in list(self._fields.values()))
+        return sum(field.length.value for field in self._fields.values())
 
     def verify(self):
         if self.binlength % 8:
@@ -569,24 +702,15 @@ class BinaryContainerTemplate(_Template):
         return container
 
     def decode(self, data, parent=None, name=None, little_endian=False):
+        if self._codec is None:
+            self.compile()
         container = self._get_struct(name, parent, little_endian=little_endian)
-        if little_endian:
-            data = data[::-1]
-        bin_str = to_binary_string_of_length(self.binlength, data[:self.binlength / 8])
-        data_index = 2
-        for field in list(self._fields.values()):
-            container[field.name] = self._create_field(bin_str, data_index,
-                                                       field)
-            data_index += field.length.value
+        self._codec.decode(data, container, little_endian=little_endian)
         return container
 
-    def _create_field(self, bin_str, data_index, field):
-        return BinaryField(field.length.value, field.name,
-                           self._binary_substring(bin_str, data_index, field))
-
-    def _binary_substring(self, bin_str, data_index, field):
-        return to_bin(
-            "0b" + bin_str[data_index:data_index + field.length.value])
+    def compile(self):
+        """Precalculates shifts and masks of the binary fields."""
+        self._codec = BitFields(list(self._fields.values()))
 
     def validate(self, parent, message_fields, name=None):
         name = name or self.name
@@ -606,7 +730,7 @@ class TBCDContainerTemplate(_Template):
     type = 'TBCDContainer'
 
     def get_static_length(self):
-        return self.binlength / 8
+        return self.binlength // 8
 
     def _verify_not_little_endian(self, little_endian):
         if little_endian:
@@ -626,11 +750,13 @@ class TBCDContainerTemplate(_Template):
     def decode(self, data, parent=None, name=None, little_endian=False):
         self._verify_not_little_endian(little_endian)
         container = self._get_struct(name, parent)
-        a = to_tbcd_value(data)
+        digits = len(data) * 2
+        if data and data[-1] >> 4 == 0xf:
+            digits -= 1
         index = 0
-        for field in list(self._fields.values()):
-            field_length = field.length.decode(container, len(data) * 2 - index)
-            container[field.name] = Field(field.type, field.name, to_tbcd_binary(a[index:index + field_length]))
+        for field in self._fields.values():
+            field_length = field.length.decode(container, digits - index)
+            container[field.name] = Field(field.type, field.name, to_tbcd_digits(data, index, field_length))
             index += field_length
         return container
 
@@ -641,7 +767,7 @@ class TBCDContainerTemplate(_Template):
 
     @property
     def binlength(self):
-        length = sum(field.length.value for field in list(self._fields.values()))
+        length = sum(field.length.value for field in self._fields.values())
         return int(ceil(length / 2.0) * 8)
 
     def _get_struct(self, name, parent):
@@ -11,111 +11,197 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
-import time
+from collections import deque
+import socket
 import threading
-import traceback
+import time
 import re
 
-from Rammbock.logger import logger
+from Rammbock.logger import logger, Deferred
 from Rammbock.binary_tools import to_bin, to_int
-from Rammbock.synchronization import LOCK
+from Rammbock.reactor import REACTOR
 
 
 class MessageStream(object):
+    _max_matchers = 32
+    _poll_interval = 0.1
 
     def __init__(self, stream, protocol):
-        self._cache = []
+        self._cache = _MessageCache()
         self._stream = stream
         self._protocol = protocol
         self._handlers = []
-        self._handler_thread = None
-        self._running = True
+        self._matchers = {}
         self._interval = 0.5
+        self._lock = threading.RLock()
 
     def close(self):
-        self._running = False
-        self.empty()
+        if self._handlers:
+            REACTOR.unregister(self)
+        self._cache = _MessageCache()
+        self._stream.close()
 
     def set_handler(self, msg_template, handler_func, header_filter, interval):
         self._handlers.append((msg_template, handler_func, header_filter))
         if interval:
             self._interval = float(interval)
-        if not self._handler_thread:
-            self._handler_thread = threading.Thread(target=self.match_handlers_periodically, name="Background handler")
-            self._handler_thread.daemon = True
-            self._handler_thread.start()
+        REACTOR.register(self, self._stream.fileno(), self._interval)
 
-    def get(self, message_template, timeout=None, header_filter=None, latest=None):
+    def get(self, message_template, timeout=None, header_filter=None, latest=None, lazy=False):
         header_fields = message_template.header_parameters
-        logger.trace("Get message with params %s" % header_fields)
+        logger.trace(Deferred("Get message with params {}".format, header_fields))
+        matcher = self._get_matcher(header_fields, header_filter)
+        if latest:
+            self._fill_cache()
+        timeout = timeout or self._stream.default_timeout
+        cutoff = time.time() + float(timeout) if timeout else None
+        while True:
+            # Handlers may cache the message while this thread waits.
+            with self._lock:
+                msg = self._get_from_cache(message_template, matcher, latest, lazy)
+            if msg:
+                logger.trace(Deferred("Cache hit. Cache currently has {} messages".format, len(self._cache)))
+                return msg
+            if cutoff is not None and time.time() >= cutoff:
+                raise AssertionError('Timeout %fs exceeded in message stream.' % float(timeout))
+            message = self._poll_message(cutoff)
+            if message is None:
+                continue
+            header, pdu_bytes = message
+            with self._lock:
+                if matcher(header):
+                    return self._to_msg(message_template, header, pdu_bytes, lazy)
+                handler_call = self._match_or_cache(header, pdu_bytes)
+            self._call_handlers([handler_call])
+
+    def _poll_message(self, cutoff):
+        """Reads one message waiting at most `_poll_interval` at a time, if
+        the protocol is read in whole frames. Returns None if no message was
+        received in that time. The last wait fails like a normal read."""
+        if cutoff is None:
+            return self._read_message(None)
+        remaining = cutoff - time.time()
+        if remaining <= self._poll_interval or self._protocol.header_length() < 0:
+            return self._read_message(max(remaining, 0.001))
+        try:
+            return self._read_message(self._poll_interval)
+        except (socket.timeout, AssertionError):
+            return None
+
+    def get_messages(self, message_template, count, timeout=None, header_filter=None, latest=None, lazy=False):
+        """Yields `count` messages matching the template. All matching
+        messages in the cache and whole messages already in the buffer are
+        taken at once, and the connection is waited only when they run
+        out. Waiting for one message fails like in `get`."""
+        matcher = self._get_matcher(message_template.header_parameters, header_filter)
         if latest:
             self._fill_cache()
-        msg = self._get_from_cache(message_template, header_fields, header_filter, latest)
-        if msg:
-            logger.trace("Cache hit. Cache currently has %s messages" % len(self._cache))
-            return msg
+        while count > 0:
+            with self._lock:
+                messages = self._get_many_from_cache(message_template, matcher, count, latest, lazy)
+            if not messages:
+                messages = self._receive_many(message_template, matcher, count, timeout, lazy)
+            count -= len(messages)
+            for msg in messages:
+                yield msg
+
+    def _get_many_from_cache(self, template, matcher, count, latest, lazy):
+        messages = []
+        while len(messages) < count:
+            msg = self._get_from_cache(template, matcher, latest, lazy)
+            if not msg:
+                break
+            messages.append(msg)
+        return messages
+
+    def _receive_many(self, template, matcher, count, timeout, lazy):
         cutoff = time.time() + float(timeout if timeout else 0)
         while not timeout or time.time() < cutoff:
-            with LOCK:
-                header, pdu_bytes = self._protocol.read(self._stream, timeout=timeout)
-                if self._matches(header, header_fields, header_filter):
-                    return self._to_msg(message_template, header, pdu_bytes)
-                else:
-                    self._match_or_cache(header, pdu_bytes)
+            messages, handler_calls = [], []
+            received = self._read_messages(timeout)
+            with self._lock:
+                for header, pdu_bytes in received:
+                    if len(messages) < count and matcher(header):
+                        messages.append(self._to_msg(template, header, pdu_bytes, lazy))
+                    else:
+                        handler_calls.append(self._match_or_cache(header, pdu_bytes))
+            self._call_handlers(handler_calls)
+            if messages:
+                return messages
         raise AssertionError('Timeout %fs exceeded in message stream.' % float(timeout))
 
+    def _read_message(self, timeout):
+        # Only the stream lock is held while waiting, so handlers and cache
+        # can be used meanwhile. It keeps the bytes of one message together.
+        with self._stream.lock:
+            return self._protocol.read(self._stream, timeout=timeout)
+
+    def _read_messages(self, timeout):
+        with self._stream.lock:
+            messages = [self._protocol.read(self._stream, timeout=timeout)]
+            return messages + self._protocol.read_buffered(self._stream)
+
     def _match_or_cache(self, header, pdu_bytes):
+        """Caches the message or returns the handler and message to call it
+        with. Handlers are called after releasing the lock."""
         for template, func, handler_filter in self._handlers:
-            if self._matches(header, template.header_parameters, handler_filter):
-                msg_to_be_sent = self._to_msg(template, header, pdu_bytes)
-                logger.debug("Calling handler %s for message %s" % (func, msg_to_be_sent))
-                self._call_handler_function(func, msg_to_be_sent)
-                return
+            if self._get_matcher(template.header_parameters, handler_filter)(header):
+                return func, self._to_msg(template, header, pdu_bytes)
         self._cache.append((header, pdu_bytes))
+        return None
+
+    def _call_handlers(self, handler_calls):
+        for handler_call in handler_calls:
+            if handler_call:
+                func, msg = handler_call
+                logger.debug(Deferred("Calling handler {} for message {}".format, func, msg))
+                self._call_handler_function(func, msg)
 
     def _get_call_handler(self, handler_name):
         module, function = handler_name.split('.')
         mod = __import__(module)
         return getattr(mod, function)
 
-    def _get_from_cache(self, template, fields, header_filter, latest):
-        indexes = list(range(len(self._cache)))
-        for index in indexes if not latest else reversed(indexes):
-            header, pdu = self._cache[index]
-            if self._matches(header, fields, header_filter):
-                self._cache.pop(index)
-                return self._to_msg(template, header, pdu)
+    def _get_from_cache(self, template, matcher, latest, lazy=False):
+        if not self._cache:
+            return None
+        if matcher.key is not None:
+            message = self._cache.pop_by_key(matcher.name, matcher.key, matcher.get_field_key, latest)
+        else:
+            message = self._cache.pop_first(matcher, latest)
+        if message:
+            header, pdu = message
+            return self._to_msg(template, header, pdu, lazy)
         return None
 
-    def _to_msg(self, template, header, pdu_bytes):
+    def _get_matcher(self, fields, header_filter):
+        if not header_filter:
+            return _MATCH_ALL
+        if header_filter not in fields:
+            raise AssertionError('Trying to filter messages by header field %s, but no value has been set for %s' %
+                                 (header_filter, header_filter))
+        key = (header_filter, fields[header_filter])
+        # Matchers of the most recently used filter values are kept, so that
+        # filtering by ever changing values does not grow the cache.
+        with self._lock:
+            matcher = self._matchers.pop(key, None)
+            if matcher is None:
+                matcher = _HeaderMatcher(header_filter, fields[header_filter],
+                                         self._protocol._get_field(header_filter))
+                if len(self._matchers) >= self._max_matchers:
+                    del self._matchers[next(iter(self._matchers))]
+            self._matchers[key] = matcher
+            return matcher
+
+    def _to_msg(self, template, header, pdu_bytes, lazy=False):
         if template.only_header:
             return header
-        msg = template.decode(pdu_bytes, parent=header)
+        msg = template.decode(pdu_bytes, parent=header, lazy=lazy)
         msg._add_header(header)
         return msg
 
-    def _matches(self, header, fields, header_filter):
-        if header_filter:
-            if header_filter not in fields:
-                raise AssertionError('Trying to filter messages by header field %s, but no value has been set for %s' %
-                                     (header_filter, header_filter))
-            field = header[header_filter]
-            if field._type == 'chars':
-                if fields[header_filter].startswith('REGEXP:'):
-                    try:
-                        regexp = fields[header_filter].split(':')[1].strip()
-                        return bool(re.match(regexp, field.ascii))
-                    except re.error as e:
-                        raise Exception("Invalid RegEx Error : " + str(e))
-                return field.ascii == fields[header_filter]
-            if field._type == 'uint':
-                return field.uint == to_int(fields[header_filter])
-            if header[header_filter].bytes != to_bin(fields[header_filter]):
-                return False
-        return True
-
     def empty(self):
-        self._cache = []
+        self._cache = _MessageCache()
         self._stream.empty()
 
     def get_messages_count_in_cache(self):
@@ -127,36 +213,59 @@ class MessageStream(object):
     def _fill_cache(self):
         try:
             while True:
-                header, pdu_bytes = self._protocol.read(self._stream, timeout=0.2)
-                self._cache.append((header, pdu_bytes))
+                messages = self._read_messages(timeout=0.2)
+                with self._lock:
+                    self._cache.extend(messages)
         except:
             pass
 
-    def match_handlers_periodically(self):
-        while self._running:
-            time.sleep(self._interval)
-            self.match_handlers()
+    def match_handlers(self, readable=False):
+        """Passes cached and buffered messages to matching handlers. If the
+        connection is `readable`, also receives new messages. Returns False
+        if the peer has closed the connection and None if another thread is
+        receiving from the stream. A partially received message does not
+        close the connection."""
+        messages = self._receive_for_handlers(readable)
+        with self._lock:
+            handler_calls = self._try_matching_cached_to_templates()
+            handler_calls += [self._match_or_cache(header, pdu_bytes) for header, pdu_bytes in messages or []]
+        self._call_handlers(handler_calls)
+        return None if messages is None else not self._stream.eof
 
-    def match_handlers(self):
+    def _receive_for_handlers(self, readable):
+        if not self._stream.lock.acquire(blocking=False):
+            # The receiving thread passes the messages to handlers.
+            return None
         try:
-            while True:
-                with LOCK:
-                    self._try_matching_cached_to_templates()
-                    header, pdu_bytes = self._protocol.read(self._stream, timeout=0.01)
-                    self._match_or_cache(header, pdu_bytes)
-        except Exception:
-            logger.debug("failure in matching cache %s" % traceback.format_exc())
+            messages = self._protocol.read_buffered(self._stream)
+            if readable:
+                messages += self._read_more_for_handlers()
+            return messages
+        except AssertionError:
+            return []
+        finally:
+            self._stream.lock.release()
+
+    def _read_more_for_handlers(self):
+        try:
+            return self._read_messages(timeout=0.01)
+        except (socket.timeout, AssertionError):
+            # Data was already read by someone else, only part of a message
+            # has arrived or the connection closed.
+            return []
 
     # FIXME: Is this actually necessary? Wouldnt we always match before caching?
     # Unless of course the handler was set after caching happened...
     def _try_matching_cached_to_templates(self):
+        handler_calls = []
         if not self._cache:
-            return
+            return handler_calls
         for template, func, handler_filter in self._handlers:
-            msg = self._get_from_cache(template, template.header_parameters, handler_filter, False)
+            matcher = self._get_matcher(template.header_parameters, handler_filter)
+            msg = self._get_from_cache(template, matcher, False)
             if msg:
-                logger.debug("Calling handler %s for cached message %s" % (func, msg))
-                self._call_handler_function(func, msg)
+                handler_calls.append((func, msg))
+        return handler_calls
 
     def _call_handler_function(self, func, msg):
         func = self._get_call_handler(func)
@@ -173,3 +282,153 @@ class MessageStream(object):
         if connection.parent:
             return connection.parent, connection
         return connection, None
+
+
+class _HeaderMatcher(object):
+    """Matches received headers against expected value of one header field.
+
+    Expected value is converted once when the matcher is created. Matching
+    compares the raw bytes of the received field to it, or the ascii value
+    for chars fields. `REGEXP:` values are compiled and can not be used as
+    cache keys.
+    """
+    _no_match = object()
+
+    def __init__(self, name, value, template_field=None):
+        self.name = name
+        self.key = None
+        self._value = value
+        self._regexp = None
+        if template_field:
+            self._compile(template_field.type, self._get_static_length(template_field))
+
+    def _get_static_length(self, template_field):
+        return template_field.length.value if template_field.length.static else None
+
+    def _compile(self, field_type, length):
+        self._type = field_type
+        if field_type == 'chars' and self._value.startswith('REGEXP:'):
+            try:
+                self._regexp = re.compile(self._value.split(':')[1].strip())
+            except re.error as e:
+                raise Exception("Invalid RegEx Error : " + str(e))
+        elif field_type == 'chars':
+            self.key = self._value
+        elif field_type == 'uint' and length is not None:
+            self.key = self._uint_to_bytes(to_int(self._value), length)
+        elif field_type == 'uint':
+            self._type = 'dynamic uint'
+            self.key = to_int(self._value)
+        else:
+            self.key = to_bin(self._value)
+
+    def _uint_to_bytes(self, value, length):
+        if 0 <= value < 1 << (8 * length):
+            return value.to_bytes(length, 'big')
+        return self._no_match
+
+    def get_field_key(self, field):
+        if self._type == 'chars':
+            return field.ascii
+        if self._type == 'dynamic uint':
+            return field.uint
+        return field.bytes
+
+    def __call__(self, header):
+        field = header[self.name]
+        if self.key is None and self._regexp is None:
+            self._compile(field._type, None)
+        if self._regexp:
+            return bool(self._regexp.match(field.ascii))
+        return self.get_field_key(field) == self.key
+
+
+class _MatchAll(object):
+    name = None
+    key = None
+
+    def __call__(self, header):
+        return True
+
+
+_MATCH_ALL = _MatchAll()
+
+
+class _MessageCache(object):
+    """Received messages in arrival order.
+
+    Messages can be taken in order or by the value of a header field. Index
+    for a header field is built when it is first used and kept up to date
+    after that. Indexes may refer to messages already taken by other means;
+    those are skipped and the indexes are rebuilt when they grow too stale.
+    """
+
+    def __init__(self):
+        self._messages = {}
+        self._indexes = {}
+        self._counter = 0
+        self._stale = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(list(self._messages.values()))
+
+    def append(self, message):
+        self._counter += 1
+        self._messages[self._counter] = message
+        for name, (index, get_field_key) in self._indexes.items():
+            self._add_to_index(index, name, get_field_key, self._counter, message)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def pop_first(self, matches, latest=False):
+        # The loop ends when the message is popped, so the ids need not
+        # be copied.
+        for message_id in reversed(self._messages) if latest else self._messages:
+            if matches(self._messages[message_id][0]):
+                return self._pop(message_id)
+        return None
+
+    def pop_by_key(self, name, key, get_field_key, latest=False):
+        index = self._get_index(name, get_field_key)
+        ids = index.get(key)
+        while ids:
+            message_id = ids.pop() if latest else ids.popleft()
+            if message_id in self._messages:
+                # The entry taken here is not left stale by _pop.
+                self._stale -= 1
+                return self._pop(message_id)
+            self._stale -= 1
+        index.pop(key, None)
+        return None
+
+    def _pop(self, message_id):
+        message = self._messages.pop(message_id)
+        header = message[0]
+        # Entries of the message in the indexes are stale from now on.
+        self._stale += sum(1 for name in self._indexes if name in header)
+        # Indexes are dropped when they have more stale entries than there
+        # are cached messages, so the cost of rebuilding them is covered by
+        # the pops that made the entries stale. The constant keeps small
+        # caches from rebuilding all the time.
+        if self._stale > len(self._messages) + 100:
+            self._indexes = {}
+            self._stale = 0
+        return message
+
+    def _get_index(self, name, get_field_key):
+        if name not in self._indexes:
+            index = {}
+            self._indexes[name] = (index, get_field_key)
+            for message_id, message in self._messages.items():
+                self._add_to_index(index, name, get_field_key, message_id, message)
+        return self._indexes[name][0]
+
+    def _add_to_index(self, index, name, get_field_key, message_id, message):
+        header = message[0]
+        if name in header:
+            index.setdefault(get_field_key(header[name]), deque()).append(message_id)
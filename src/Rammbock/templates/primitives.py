@@ -16,10 +16,30 @@ from math import ceil
 import math
 import sys
 import re
+import threading
+from contextlib import contextmanager
 
 from Rammbock.message import Field, BinaryField
 from Rammbock.binary_tools import to_bin_of_length, to_0xhex, to_tbcd_binary, \
-    to_tbcd_value, to_bin, to_twos_comp, to_int
+    to_tbcd_value, to_bin, to_twos_comp, to_int, encode_uint, decode_int
+
+
+class _SharedExpectedValues(threading.local):
+    values = None
+
+
+_SHARED_EXPECTED_VALUES = _SharedExpectedValues()
+
+
+@contextmanager
+def shared_expected_values(values):
+    """Expected values of fields with static length are encoded only once
+    into `values` while validating in this thread inside the block."""
+    previous, _SHARED_EXPECTED_VALUES.values = _SHARED_EXPECTED_VALUES.values, values
+    try:
+        yield
+    finally:
+        _SHARED_EXPECTED_VALUES.values = previous
 
 
 class _TemplateField(object):
@@ -27,11 +47,16 @@ class _TemplateField(object):
     def __init__(self, name, default_value):
         self._set_default_value(default_value)
         self.name = name
+        self._encoded_defaults = {}
 
     has_length = True
     can_be_little_endian = False
     referenced_later = False
 
+    @property
+    def has_static_layout(self):
+        return self.length.static
+
     def get_static_length(self):
         if not self.length.static:
             raise IndexError('Length of %s is dynamic.' % self._get_name())
@@ -52,9 +77,19 @@ class _TemplateField(object):
         return self._to_field(name, value, parent, little_endian=little_endian)
 
     def _to_field(self, name, value, parent, little_endian=False):
-        field_name, field_value = self._encode_value(value, parent, little_endian=little_endian)
+        field_name, field_value = self._get_encoded_value(value, parent, little_endian=little_endian)
         return Field(self.type, self._get_name(name), field_name, field_value, little_endian=little_endian)
 
+    def _get_encoded_value(self, value, parent, little_endian=False):
+        # Default value of a field with static length encodes always to the
+        # same bytes, so it is parsed only once. Other values are parsed
+        # every time.
+        if value != self.default_value or not self.length.static:
+            return self._encode_value(value, parent, little_endian=little_endian)
+        if little_endian not in self._encoded_defaults:
+            self._encoded_defaults[little_endian] = self._encode_value(value, parent, little_endian=little_endian)
+        return self._encoded_defaults[little_endian]
+
     def decode(self, data, message, name=None, little_endian=False):
         data = self._prepare_data(data)
         length, aligned_length = self.length.decode_lengths(message, len(data))
@@ -117,13 +152,22 @@ class _TemplateField(object):
     def _apply_mask_to_values(self, forced_pattern, value):
         val = forced_pattern[1:-1].split('&')[0].strip()
         mask = forced_pattern[1:-1].split('&')[1].strip()
-        return to_int(val) & to_int(mask), to_int(to_0xhex(value)) & to_int(mask)
+        return to_int(val) & to_int(mask), decode_int(value) & to_int(mask)
 
     def _is_match(self, forced_value, value, parent):
         # TODO: Should pass msg
-        forced_binary_val, _ = self._encode_value(forced_value, parent)
+        forced_binary_val, _ = self._get_expected_value(forced_value, parent)
         return forced_binary_val == value
 
+    def _get_expected_value(self, value, parent):
+        expected = _SHARED_EXPECTED_VALUES.values
+        if expected is None or not self.length.static:
+            return self._get_encoded_value(value, parent)
+        key = (self, value)
+        if key not in expected:
+            expected[key] = self._get_encoded_value(value, parent)
+        return expected[key]
+
     def _validate_exact_match(self, forced_value, value, field):
         if not self._is_match(forced_value, value, field._parent):
             return ['Value of field %s does not match %s!=%s' %
@@ -170,9 +214,12 @@ class UInt(_TemplateField):
     def _encode_value(self, value, message, little_endian=False):
         self._raise_error_if_no_value(value, message)
         length, aligned_length = self.length.decode_lengths(message)
-        binary = to_bin_of_length(length, value)
-        binary = binary[::-1] if little_endian else binary
-        return binary, aligned_length
+        return encode_uint(self._to_int(value), length, little_endian), aligned_length
+
+    def _to_int(self, value):
+        if isinstance(value, int):
+            return value
+        return to_int(str(value).replace(' ', ''))
 
 
 class Int(UInt):
@@ -207,6 +254,10 @@ class Char(_TemplateField):
         self._terminator = to_bin(terminator)
         self.length = Length(length)
 
+    @property
+    def has_static_layout(self):
+        return self.length.static and not self._terminator
+
     def _encode_value(self, value, message, little_endian=False):
         if isinstance(value, Field):
             value = value._value
@@ -218,7 +269,7 @@ class Char(_TemplateField):
 
     def _prepare_data(self, data):
         if self._terminator:
-            return data[0:data.index(self._terminator) + len(self._terminator)]
+            return data[0:bytes(data).index(self._terminator) + len(self._terminator)]
         return data
 
     def _validate_regexp(self, forced_pattern, value, field):
@@ -236,6 +287,7 @@ class Char(_TemplateField):
 class Binary(_TemplateField):
 
     type = 'bin'
+    has_static_layout = False
 
     def __init__(self, length, name, default_value=None):
         _TemplateField.__init__(self, name, default_value)
@@ -251,20 +303,21 @@ class Binary(_TemplateField):
         return binary, self._byte_length(aligned)
 
     def _to_field(self, name, value, parent, little_endian=False):
-        field_name, field_value = self._encode_value(value, parent, little_endian=little_endian)
+        field_name, field_value = self._get_encoded_value(value, parent, little_endian=little_endian)
         return BinaryField(self.length.value, self._get_name(name), field_name, field_value, little_endian=little_endian)
 
     def _byte_length(self, length):
         return int(ceil(length / 8.0))
 
     def _is_match(self, forced_value, value, message):
-        forced_binary_val, _ = self._encode_value(forced_value, message)   # TODO: Should pass msg
-        return int(to_0xhex(forced_binary_val), 16) == int(to_0xhex(value), 16)
+        forced_binary_val, _ = self._get_expected_value(forced_value, message)   # TODO: Should pass msg
+        return decode_int(forced_binary_val) == decode_int(value)
 
 
 class TBCD(_TemplateField):
 
     type = 'tbcd'
+    has_static_layout = False
 
     def __init__(self, size, name, default_value):
         _TemplateField.__init__(self, name, default_value)
@@ -287,6 +340,7 @@ class PDU(_TemplateField):
 
     type = 'pdu'
     name = '__pdu__'
+    has_static_layout = False
 
     def __init__(self, length):
         self.length = Length(length)
@@ -0,0 +1,135 @@
+import asyncio
+from unittest import TestCase, main
+from Rammbock import async_networking
+from Rammbock.async_networking import AsyncMessageStream, start_tcp_server, open_tcp_client, \
+    start_udp_server, open_udp_client
+from Rammbock.templates.containers import Protocol, MessageTemplate
+from Rammbock.templates.primitives import UInt, PDU, Char
+from Rammbock.binary_tools import to_bin
+
+LOCAL_IP = '127.0.0.1'
+
+
+def get_protocol():
+    protocol = Protocol('Test')
+    protocol.add(UInt(1, 'id', None))
+    protocol.add(UInt(1, 'length', None))
+    protocol.add(PDU('length-2'))
+    return protocol
+
+
+def get_template(protocol, message_id):
+    template = MessageTemplate('Foo', protocol, {'id': message_id})
+    template.add(UInt(1, 'value', None))
+    return template
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 5))
+
+
+class TestAsyncMessageStream(TestCase):
+
+    def setUp(self):
+        self._protocol = get_protocol()
+
+    def test_messages_are_split_from_received_data(self):
+        async def test():
+            stream = AsyncMessageStream(self._protocol)
+            stream.feed(to_bin('0x010301 0203'))
+            stream.feed(to_bin('0x02'))
+            first = await stream.get(get_template(self._protocol, '2'), header_filter='id')
+            second = await stream.get(get_template(self._protocol, '1'), header_filter='id')
+            return first.value.int, second.value.int
+        self.assertEqual(run(test()), (2, 1))
+
+    def test_get_waits_for_message(self):
+        async def test():
+            stream = AsyncMessageStream(self._protocol)
+            asyncio.get_running_loop().call_later(0.01, stream.feed, to_bin('0x010305'))
+            return (await stream.get(get_template(self._protocol, '1'), timeout=1)).value.int
+        self.assertEqual(run(test()), 5)
+
+    def test_get_timeout(self):
+        async def test():
+            await AsyncMessageStream(self._protocol).get(get_template(self._protocol, '1'), timeout=0.01)
+        self.assertRaises(AssertionError, run, test())
+
+    def test_coroutine_handler(self):
+        async def test():
+            handled = asyncio.get_running_loop().create_future()
+
+            async def handler(msg, connection):
+                handled.set_result(msg.value.int)
+            stream = AsyncMessageStream(self._protocol)
+            stream.set_handler(get_template(self._protocol, '1'), handler, 'id')
+            stream.feed(to_bin('0x020307 010308'))
+            return await handled, len(stream._cache)
+        self.assertEqual(run(test()), (8, 1))
+
+    def test_failing_coroutine_handler_is_logged(self):
+        warnings = []
+
+        async def test():
+            async def handler(msg, connection):
+                raise RuntimeError('handler failed')
+            stream = AsyncMessageStream(self._protocol)
+            stream.set_handler(get_template(self._protocol, '1'), handler, 'id')
+            stream.feed(to_bin('0x010308'))
+            running = len(stream._handler_tasks)
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            return running, len(stream._handler_tasks)
+        original, async_networking.logger.warn = async_networking.logger.warn, warnings.append
+        try:
+            self.assertEqual(run(test()), (1, 0))
+        finally:
+            async_networking.logger.warn = original
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue('handler failed' in warnings[0])
+
+    def test_dynamic_header_is_not_supported(self):
+        protocol = Protocol('Dynamic')
+        protocol.add(UInt(1, 'len', None))
+        protocol.add(Char('len', 'name', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length'))
+        self.assertRaises(AssertionError, AsyncMessageStream, protocol)
+
+
+class TestAsyncNetworking(TestCase):
+
+    def setUp(self):
+        self._protocol = get_protocol()
+
+    def test_tcp_request_and_response(self):
+        async def test():
+            server = await start_tcp_server(self._protocol, LOCAL_IP, 0)
+            client = await open_tcp_client(self._protocol, *server.get_own_address())
+            connection = await server.accept(timeout=1)
+            connection.set_handler(get_template(self._protocol, '1'),
+                                   lambda msg, conn: conn.send(to_bin('0x0203') + bytes([msg.value.int + 1])),
+                                   'id')
+            client.send(to_bin('0x010341'))
+            response = await client.get_message(get_template(self._protocol, '2'), timeout=1, header_filter='id')
+            client.close()
+            server.close()
+            return response.value.int
+        self.assertEqual(run(test()), 0x42)
+
+    def test_udp_request_and_response(self):
+        async def test():
+            server = await start_udp_server(self._protocol, LOCAL_IP, 0)
+            client = await open_udp_client(self._protocol, *server.get_own_address())
+            client.send(to_bin('0x010341'))
+            request = await server.get_message(get_template(self._protocol, '1'), timeout=1)
+            server.send(to_bin('0x020342'))
+            response = await client.get_message(get_template(self._protocol, '2'), timeout=1)
+            client.close()
+            server.close()
+            return request.value.int, response.value.int
+        self.assertEqual(run(test()), (0x41, 0x42))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 from unittest import TestCase, main
 from Rammbock.binary_tools import to_bin, to_bin_of_length, to_hex, to_0xhex, \
     to_binary_string_of_length, to_tbcd_value, to_bin_str_from_int_string, \
-    to_tbcd_binary, to_twos_comp, from_twos_comp
+    to_tbcd_binary, to_twos_comp, from_twos_comp, encode_uint, decode_int, \
+    to_tbcd_digits
 
 
 class TestBinaryConversions(TestCase):
@@ -79,6 +80,19 @@ class TestBinaryConversions(TestCase):
         self.assertEqual(to_binary_string_of_length(2048, b'\xff\xff\xff\xff\xff\xff\xff\xff' * 32),
                          '0b' + ('11' * 1024))
 
+    def test_encode_uint(self):
+        self.assertEqual(encode_uint(0, 1), b'\x00')
+        self.assertEqual(encode_uint(256, 3), b'\x00\x01\x00')
+        self.assertEqual(encode_uint(256, 3, little_endian=True), b'\x00\x01\x00'[::-1])
+        self.assertRaises(AssertionError, encode_uint, 256, 1)
+        self.assertRaises(AssertionError, encode_uint, -1, 1)
+
+    def test_decode_int(self):
+        self.assertEqual(decode_int(b'\x01\x00'), 256)
+        self.assertEqual(decode_int(b'\x01\x00', little_endian=True), 1)
+        self.assertEqual(decode_int(b'\xff\xeb', signed=True), -21)
+        self.assertEqual(decode_int(b'\xff\xeb'), 65515)
+
     def test_to_tbcd_value(self):
         self.assertEqual('1', to_tbcd_value(to_bin('0b11110001')))
         self.assertEqual('11', to_tbcd_value(to_bin('0b00010001')))
@@ -95,6 +109,21 @@ class TestBinaryConversions(TestCase):
         self.assertEqual(to_bin('0b0110001000010010000000100000000000000000000000000000000011110001'),
                          to_tbcd_binary('262120000000001'))
 
+    def test_tbcd_keeps_leading_zeros(self):
+        self.assertEqual(to_bin('0x0010 f1'), to_tbcd_binary('00011'))
+        self.assertEqual('00011', to_tbcd_value(to_tbcd_binary('00011')))
+
+    def test_invalid_tbcd_value(self):
+        self.assertRaises(AssertionError, to_tbcd_binary, '12a')
+
+    def test_to_tbcd_digits(self):
+        binary = to_tbcd_binary('1234567')
+        self.assertEqual(to_tbcd_binary('1234'), to_tbcd_digits(binary, 0, 4))
+        self.assertEqual(to_tbcd_binary('123'), to_tbcd_digits(binary, 0, 3))
+        self.assertEqual(to_tbcd_binary('2345'), to_tbcd_digits(binary, 1, 4))
+        self.assertEqual(to_tbcd_binary('567'), to_tbcd_digits(binary, 4, 3))
+        self.assertEqual(to_tbcd_binary('4567'), to_tbcd_digits(binary, 3, 4))
+
     def test_to_bin_str_from_int_string(self):
         self.assertEqual('00000001', to_bin_str_from_int_string(8, '1'))
         self.assertEqual('00000010', to_bin_str_from_int_string(8, '2'))
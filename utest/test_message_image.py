@@ -0,0 +1,49 @@
+from unittest import TestCase, main
+from Rammbock.message_image import MessageImage
+from Rammbock.templates.containers import Protocol, MessageTemplate, StructTemplate
+from Rammbock.templates.primitives import UInt, Int, PDU
+from Rammbock.binary_tools import to_bin
+
+
+class TestMessageImage(TestCase):
+
+    def setUp(self):
+        protocol = Protocol('TestProtocol')
+        protocol.add(UInt(2, 'msgId', 5))
+        protocol.add(UInt(2, 'length', None))
+        protocol.add(PDU('length-4'))
+        self.tmp = MessageTemplate('FooRequest', protocol, {})
+        self.tmp.add(UInt(2, 'seq', 1))
+        struct = StructTemplate('Pair', 'pair', self.tmp, align=4)
+        struct.add(Int(1, 'first', -1))
+        struct.add(UInt(1, 'second', 2))
+        self.tmp.add(struct)
+        self.tmp.add(UInt(4, 'teid', 3))
+        self.image = MessageImage(self.tmp.encode({}, {}))
+
+    def test_image_bytes(self):
+        self.assertEqual(self.image.bytes, self.tmp.encode({}, {})._raw)
+        self.assertEqual(len(self.image), 14)
+        self.assertEqual(self.image.patch(), self.image.bytes)
+
+    def test_patch_fields(self):
+        patched = self.image.patch({'seq': '0x0102', 'pair.first': '-2', 'teid': 7},
+                                   {'msgId': '6'})
+        self.assertEqual(patched, to_bin('0x0006 000e 0102 fe02 0000 0000 0007'))
+        self.assertEqual(self.image.bytes, to_bin('0x0005 000e 0001 ff02 0000 0000 0003'))
+
+    def test_patched_message_equals_encoded_message(self):
+        fields = {'seq': '42', 'pair.second': '0xff'}
+        self.assertEqual(self.image.patch(dict(fields)), self.tmp.encode(fields, {})._raw)
+
+    def test_unknown_field(self):
+        self.assertRaises(AssertionError, self.image.patch, {'foo': '1'})
+        self.assertRaises(AssertionError, self.image.patch, {}, {'seq': '1'})
+
+    def test_value_out_of_range(self):
+        self.assertRaises(AssertionError, self.image.patch, {'seq': '65536'})
+        self.assertRaises(AssertionError, self.image.patch, {'pair.first': '128'})
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
+import copy
+import pickle
 from unittest import TestCase, main
-from Rammbock.message import Struct, Field, BinaryContainer, BinaryField
+from Rammbock.message import Struct, Field, BinaryContainer, BinaryField, Bag, List
 from Rammbock.binary_tools import to_bin
 
 
@@ -34,6 +36,71 @@ class TestMessages(TestCase):
         self.assertEqual(field.chars, 'ab')
         self.assertEqual(field.bin, '0b00000000' + '01100001' + '01100010' + '00000000')
 
+    def test_field_from_view_is_materialized_on_access(self):
+        data = memoryview(to_bin('0xcafebabe'))
+        field = Field('uint', 'name', data[1:3])
+        self.assertEqual(len(field), 2)
+        self.assertEqual(field.bytes, b'\xfe\xba')
+        self.assertTrue(isinstance(field._data, bytes))
+
+    def test_deepcopy_field_with_view(self):
+        field = Field('uint', 'name', memoryview(to_bin('0xcafe')))
+        self.assertEqual(copy.deepcopy(field).hex, '0xcafe')
+
+    def test_elements_have_no_instance_dict(self):
+        msg = Struct('foo', 'foo_type')
+        msg['a'] = BinaryField(3, 'a', to_bin('0x01'))
+        self.assertFalse(hasattr(msg, '__dict__'))
+        self.assertFalse(hasattr(msg.a, '__dict__'))
+
+    def test_copy_structured_element(self):
+        msg = Struct('foo', 'foo_type', align=4)
+        msg['a'] = uint_field('0x01')
+        copied = copy.deepcopy(msg)
+        self.assertEqual(copied.a.hex, '0x01')
+        self.assertEqual(len(copied), 4)
+        self.assertEqual(pickle.loads(pickle.dumps(msg)).a.hex, '0x01')
+
+    def test_internal_attributes_are_not_fields(self):
+        msg = Struct('foo', 'foo_type')
+        self.assertRaises(AttributeError, getattr, msg, '__missing__')
+        self.assertRaises(AttributeError, getattr, Struct.__new__(Struct), 'field')
+
+    def test_length_is_updated_when_children_change(self):
+        msg = Struct('foo', 'foo_type')
+        child = Struct('sub', 'subelement_type')
+        child['a'] = uint_field()
+        msg['sub'] = child
+        self.assertEqual(len(msg), 1)
+        child['b'] = uint_field('0x0001')
+        self.assertEqual(len(child), 3)
+        self.assertEqual(len(msg), 3)
+        del child['a']
+        self.assertEqual(len(msg), 2)
+
+    def test_bag_count_is_updated_when_cases_change(self):
+        bag = Bag('bag')
+        first, second = List('first', 'uint'), List('second', 'uint')
+        first.add(uint_field())
+        bag['first'] = first
+        bag['second'] = second
+        self.assertEqual(bag.len, 1)
+        self.assertEqual(bag._cached_count, 1)
+        second.add(uint_field())
+        second.add(uint_field())
+        self.assertEqual(bag.len, 3)
+        del first['0']
+        self.assertEqual(bag.len, 2)
+        self.assertEqual(len(bag), 2)
+
+    def test_raw_of_nested_elements(self):
+        msg = Struct('foo', 'foo_type', align=8)
+        child = Struct('sub', 'subelement_type')
+        child['a'] = uint_field('0x0102')
+        msg['sub'] = child
+        msg['b'] = Field('uint', 'b', to_bin('0x03'), aligned_len=2)
+        self.assertEqual(msg._raw, to_bin('0x0102 0300 0000 0000'))
+
     def test_not_iterable(self):
         msg = Struct('foo', 'foo_type')
         msg['a'] = uint_field()
@@ -2,11 +2,10 @@ from contextlib import contextmanager
 from unittest import TestCase, main
 import time
 import socket
-from threading import Timer, Semaphore
+from threading import Timer
 from Rammbock.networking import UDPServer, TCPServer, UDPClient, TCPClient, BufferedStream
 from Rammbock.templates.containers import Protocol
 from Rammbock.templates.primitives import UInt, PDU
-from Rammbock import synchronization
 
 LOCAL_IP = '127.0.0.1'
 CONNECTION_ALIAS = "Connection alias"
@@ -98,6 +97,18 @@ class TestNetworking(_NetworkingTests):
         server.accept_connection()
         self._assert_receive(server, 'foofaa')
 
+    def test_send_messages_udp(self):
+        server, client = self._udp_server_and_client(ports['SERVER_PORT'], ports['CLIENT_PORT'])
+        client.send_messages(['foo'.encode(), 'faa'.encode()])
+        self._assert_receive(server, 'foo')
+        self._assert_receive(server, 'faa')
+
+    def test_send_messages_tcp(self):
+        server, client = self._tcp_server_and_client(ports['SERVER_PORT'])
+        server.accept_connection()
+        server.send_messages(['foo'.encode(), 'faa'.encode()])
+        self._assert_receive(client, 'foofaa')
+
     def test_tcp_server_with_queued_connections(self):
         server, client = self._tcp_server_and_client(ports['SERVER_PORT'])
         TCPClient().connect_to(LOCAL_IP, ports['SERVER_PORT'])
@@ -148,15 +159,6 @@ class TestNetworking(_NetworkingTests):
         server, _ = self._udp_server_and_client(ports['SERVER_PORT'], ports['CLIENT_PORT'], timeout=0.1)
         self._assert_timeout(server)
 
-    @contextmanager
-    def _without_sync(self):
-        original_LOCK = synchronization.LOCK
-        try:
-            synchronization.LOCK = Semaphore(100)
-            yield
-        finally:
-            synchronization.LOCK = original_LOCK
-
     @contextmanager
     def _client_and_server(self, port):
         server = TCPServer(LOCAL_IP, port)
@@ -168,19 +170,17 @@ class TestNetworking(_NetworkingTests):
             client.close()
 
     def test_connection_timeout(self):
-        with self._without_sync():
-            with self._client_and_server(ports['SERVER_PORT']) as (client, server):
-                timer_obj = Timer(0.1, client.connect_to, [LOCAL_IP, ports['SERVER_PORT']])
-                timer_obj.start()
-                server.accept_connection(timeout="0.5")
+        with self._client_and_server(ports['SERVER_PORT']) as (client, server):
+            timer_obj = Timer(0.1, client.connect_to, [LOCAL_IP, ports['SERVER_PORT']])
+            timer_obj.start()
+            server.accept_connection(timeout="0.5")
 
     def test_connection_timeout_failure(self):
-        with self._without_sync():
-            with self._client_and_server(ports['SERVER_PORT']) as (client, server):
-                timer_obj = Timer(0.2, client.connect_to, [LOCAL_IP, ports['SERVER_PORT']])
-                timer_obj.start()
-                self.assertRaises(socket.timeout, server.accept_connection, timeout=0.1)
-                timer_obj.cancel()
+        with self._client_and_server(ports['SERVER_PORT']) as (client, server):
+            timer_obj = Timer(0.2, client.connect_to, [LOCAL_IP, ports['SERVER_PORT']])
+            timer_obj.start()
+            self.assertRaises(socket.timeout, server.accept_connection, timeout=0.1)
+            timer_obj.cancel()
 
     # FIXME: this deadlocks
     def xtest_blocking_timeout(self):
@@ -228,7 +228,7 @@ def _get_template():
 
 
 class TestBufferedStream(TestCase):
-    DATA = 'foobardiibadaa'
+    DATA = b'foobardiibadaa'
 
     def setUp(self):
         self._buffered_stream = BufferedStream(MockConnection(self.DATA), 0.1)
@@ -247,20 +247,67 @@ class TestBufferedStream(TestCase):
 
     def test_read_and_return(self):
         self._buffered_stream.read(-1)
-        self._buffered_stream.return_data('badaa')
+        self._buffered_stream.return_data(b'badaa')
         data = self._buffered_stream.read(-1)
-        self.assertEqual(data, 'badaa')
+        self.assertEqual(data, b'badaa')
+
+    def test_read_in_parts(self):
+        self.assertEqual(self._buffered_stream.read(3), b'foo')
+        self.assertEqual(self._buffered_stream.read(3), b'bar')
+        self.assertEqual(self._buffered_stream.read(-1), b'diibadaa')
+
+    def test_return_read_data(self):
+        self._buffered_stream.read(3)
+        self._buffered_stream.return_data(b'foo')
+        self.assertEqual(self._buffered_stream.read(6), b'foobar')
+
+    def test_read_over_several_receives(self):
+        stream = BufferedStream(MockConnection(b'foo', b'bar', b'diibadaa'), 0.1)
+        self.assertEqual(stream.read(4), b'foob')
+        self.assertEqual(stream.read(10), b'ardiibadaa')
+
+    def test_buffer_is_compacted_when_room_is_needed(self):
+        stream = BufferedStream(MockConnection(b'x' * 60000, b'y' * 60000), 0.1)
+        stream.read(59999)
+        self.assertEqual(stream.read(2), b'xy')
+        self.assertEqual(stream.available, 59999)
+        self.assertTrue(len(stream._buffer) < 2 * BufferedStream._read_size)
+
+
+class TestBufferedStreamFrames(TestCase):
+
+    def setUp(self):
+        self._protocol = _get_template()
+        self._stream = BufferedStream(MockConnection(b'\x01\x00', b'\x04ab\x02\x00\x03', b'\x03'), 0.1)
+
+    def test_read_frame_over_several_receives(self):
+        frame = self._stream.read_frame(3, self._protocol.get_frame_length)
+        self.assertEqual(frame, b'\x01\x00\x04ab')
+
+    def test_read_frames_returns_only_whole_frames(self):
+        self._stream.read_frame(3, self._protocol.get_frame_length)
+        self.assertEqual(self._stream.read_frames(3, self._protocol.get_frame_length), [])
+        self._stream.read(-1)
+        self.assertEqual(self._stream.available, 0)
+
+    def test_read_many_frames_from_one_receive(self):
+        stream = BufferedStream(MockConnection(b'\x01\x00\x03a\x02\x00\x02\x03\x00'), 0.1)
+        first = stream.read_frame(3, self._protocol.get_frame_length)
+        rest = stream.read_frames(3, self._protocol.get_frame_length)
+        self.assertEqual(first, b'\x01\x00\x03a')
+        self.assertEqual(rest, [b'\x02\x00\x02'])
+        self.assertEqual(stream.available, 2)
 
 
 class MockConnection(object):
 
-    def __init__(self, mock_data_to_receive):
-        self._data = mock_data_to_receive
+    def __init__(self, *mock_data_to_receive):
+        self._data = list(mock_data_to_receive)
 
-    def receive(self, timeout):
-        ret = self._data
-        self._data = ''
-        return ret
+    def receive_into(self, buffer, timeout):
+        ret = self._data.pop(0) if self._data else b''
+        buffer[:len(ret)] = ret
+        return len(ret)
 
 
 if __name__ == "__main__":
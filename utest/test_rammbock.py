@@ -1,5 +1,8 @@
 from unittest import TestCase, main
+import threading
+import time
 from Rammbock import Rammbock
+from Rammbock.logger import logger
 
 
 class TestParamParsing(TestCase):
@@ -12,12 +15,34 @@ class TestParamParsing(TestCase):
         self.assertEqual(confs['foo'], 'bar')
         self.assertEqual(pdu_fields['doo'], 'dar')
 
+    def test_handler_log_capacity(self):
+        original = logger.capacity
+        try:
+            Rammbock(handler_log_capacity='5')
+            self.assertEqual(logger.capacity, 5)
+        finally:
+            logger.set_capacity(original)
+
     def test_use_shortest_name(self):
         confs, pdu_fields, header_fields = self.rammbock._parse_parameters(
             ['foo=this=is:config=value', 'doo:this=is:field'])
         self.assertEqual(confs['foo'], 'this=is:config=value')
         self.assertEqual(pdu_fields['doo'], 'this=is:field')
 
+    def test_load_copy_of_template(self):
+        self.rammbock.new_protocol('TestProtocol')
+        self.rammbock.uint(2, 'msgId', 5)
+        self.rammbock.uint(2, 'length', None)
+        self.rammbock.pdu('length-4')
+        self.rammbock.end_protocol()
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.uint(2, 'foo', 1)
+        self.rammbock.save_template('foo')
+        self.rammbock.load_copy_of_template('foo')
+        self.assertEqual(self.rammbock.get_message('foo:43').foo.int, 43)
+        self.rammbock.load_template('foo')
+        self.assertEqual(self.rammbock.get_message().foo.int, 1)
+
     def test_error_on_invalid_value(self):
         self.assertRaises(Exception, self.rammbock._parse_parameters, ['foo'])
 
@@ -80,8 +105,90 @@ class TestMessageSequence(TestCase):
         except:
             pass
         self._sequence_should_equal(self.rammbock._message_sequence.get(),
-                                    [['Client', '127.0.0.1:12345', 'TestProtocol:FooRequest',
-                                      '', 'sent']])
+                                    [['Client', 'Server', 'TestProtocol:FooRequest',
+                                      'Value of field foo does not match 0x00000000!=5', 'received']])
+
+    def test_send_message_image(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        image = self.rammbock.get_message_image()
+        self.rammbock.client_sends_message_image(image, 'foo:5')
+        self.rammbock.server_receives_message('foo:5')
+        self._sequence_should_equal(self.rammbock._message_sequence.get(),
+                                    [['Client', 'Server', 'TestProtocol:FooRequest', '', 'received']])
+
+    def test_send_messages(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        self.rammbock.client_sends_messages('1')
+        self.rammbock.client_sends_messages(['foo:1', ['foo:2']], 'header:msgId:6')
+        self.rammbock.server_receives_message('foo:0', 'header:msgId:5')
+        self.rammbock.server_receives_message('foo:1', 'header:msgId:6')
+        self.rammbock.server_receives_message('foo:2', 'header:msgId:6')
+        self._sequence_should_equal(self.rammbock._message_sequence.get(),
+                                    [['Client', 'Server', 'TestProtocol:FooRequest', '', 'received']] * 3)
+
+    def test_receive_messages(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        self.rammbock.client_sends_messages(['foo:1', 'foo:2', 'foo:1'])
+        msgs = self.rammbock.server_receives_messages('count=4', 'timeout=0.1', 'foo:1')
+        self.assertEqual([msg.foo.int for msg in msgs], [1, 2, 1])
+        self.assertEqual(msgs.count, 3)
+        self.assertEqual(msgs.errors, 2)
+        self.assertEqual(msgs.first_failure, 'Value of field foo does not match 0x00000002!=1')
+        self.assertEqual(len(list(self.rammbock._message_sequence.get())), 3)
+
+    def test_received_message_is_validated_with_template_loaded_before_waiting(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self.rammbock.new_message('BarRequest', 'TestProtocol', 'header:msgId:6')
+        self.rammbock.uint(1, 'bar', 1)
+        self.rammbock.save_template('bar')
+        self._foo_message()
+        self.rammbock.save_template('foo')
+        foo = self.rammbock.get_message()._raw
+
+        def load_other_template_and_send():
+            time.sleep(0.1)
+            self.rammbock.load_template('bar')
+            self.rammbock.client_sends_binary(foo)
+
+        thread = threading.Thread(target=load_other_template_and_send)
+        thread.start()
+        msg = self.rammbock.server_receives_message('timeout=2', 'foo:0')
+        thread.join()
+        self.assertEqual(msg.foo.int, 0)
+
+    def test_message_values_do_not_change_defaults(self):
+        self._example_protocol()
+        self._foo_message()
+        self.rammbock.value('foo', '1')
+        self.assertEqual(self.rammbock.get_message('foo:2', 'header:msgId:7').foo.int, 2)
+        msg = self.rammbock.get_message()
+        self.assertEqual(msg.foo.int, 1)
+        self.assertEqual(msg._header.msgId.int, 5)
+
+    def test_received_message_is_validated_with_values_given_before_waiting(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        self.rammbock.value('foo', '0')
+        foo = self.rammbock.get_message()._raw
+
+        def change_value_and_send():
+            time.sleep(0.1)
+            self.rammbock.value('foo', '1')
+            self.rammbock.client_sends_binary(foo)
+
+        thread = threading.Thread(target=change_value_and_send)
+        thread.start()
+        msg = self.rammbock.server_receives_message('timeout=2')
+        thread.join()
+        self.assertEqual(msg.foo.int, 0)
 
     def test_send_binary_without_protocol(self):
         self._start_client_server()
@@ -0,0 +1,63 @@
+from unittest import TestCase, main
+import socket
+import threading
+from Rammbock.reactor import Reactor
+
+
+class MockMessageStream(object):
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.calls = []
+        self.event = threading.Event()
+
+    def match_handlers(self, readable=False):
+        received = self._connection.recv(100) if readable else b''
+        self.calls.append((readable, received))
+        self.event.set()
+        return bool(received)
+
+
+class TestReactor(TestCase):
+
+    def setUp(self):
+        self._reactor = Reactor()
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(False)
+        self._stream = MockMessageStream(self._reader)
+
+    def tearDown(self):
+        self._reactor.unregister(self._stream)
+        self._reader.close()
+        self._writer.close()
+
+    def _wait_for_call(self):
+        self.assertTrue(self._stream.event.wait(2))
+        self._stream.event.clear()
+        return self._stream.calls[-1]
+
+    def test_readable_stream_is_handled(self):
+        self._reactor.register(self._stream, self._reader.fileno(), 10)
+        self._writer.send(b'foo')
+        self.assertEqual(self._wait_for_call(), (True, b'foo'))
+
+    def test_stream_is_checked_once_per_interval(self):
+        self._reactor.register(self._stream, self._reader.fileno(), 0.01)
+        self.assertEqual(self._wait_for_call(), (False, b''))
+
+    def test_unregistered_stream_is_not_handled(self):
+        self._reactor.register(self._stream, self._reader.fileno(), 10)
+        self._reactor.unregister(self._stream)
+        self._writer.send(b'foo')
+        self.assertFalse(self._stream.event.wait(0.1))
+
+    def test_closed_connection_is_muted(self):
+        self._reactor.register(self._stream, self._reader.fileno(), 10)
+        self._writer.close()
+        self.assertEqual(self._wait_for_call(), (True, b''))
+        self.assertFalse(self._stream.event.wait(0.1))
+        self.assertEqual(len(self._stream.calls), 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+from unittest import TestCase, main
+from contextlib import redirect_stdout
+import io
+import logging
+import threading
+from Rammbock.robotbackgroundlogger import BackgroundLogger, Deferred
+
+
+class Lazy(object):
+
+    def __init__(self):
+        self.formatted = False
+
+    def __str__(self):
+        self.formatted = True
+        return 'lazy'
+
+
+class TestBackgroundLogger(TestCase):
+
+    def setUp(self):
+        self._logger = BackgroundLogger(capacity=3)
+        self._original_level = logging.getLogger().level
+        logging.getLogger().setLevel(logging.NOTSET)
+
+    def tearDown(self):
+        logging.getLogger().setLevel(self._original_level)
+
+    def _write_in_thread(self, *messages, **config):
+        def write():
+            for message in messages:
+                self._logger.write(message, config.get('level', 'INFO'))
+        thread = threading.Thread(target=write, name=config.get('name', 'Background'))
+        thread.start()
+        thread.join()
+
+    def _log(self, name=None):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self._logger.log_background_messages(name)
+        return [line.split('* ', 1)[-1] for line in output.getvalue().splitlines()]
+
+    def test_messages_are_logged_per_thread(self):
+        self._write_in_thread('a', 'b', name='first')
+        self._write_in_thread('c', name='second')
+        self.assertEqual(self._log(), ["<b>Messages by 'first'</b>", 'a', 'b',
+                                       "<b>Messages by 'second'</b>", 'c'])
+        self.assertEqual(self._log(), [])
+
+    def test_oldest_messages_are_dropped(self):
+        self._write_in_thread('a', 'b', 'c', 'd', 'e')
+        self.assertEqual(self._log('Background'), ['2 older messages were dropped.', 'c', 'd', 'e'])
+
+    def test_messages_are_formatted_when_logged(self):
+        message = Lazy()
+        self._write_in_thread(message)
+        self.assertFalse(message.formatted)
+        self.assertEqual(self._log('Background'), ['lazy'])
+
+    def test_reset(self):
+        self._write_in_thread('a')
+        self._logger.reset_background_messages()
+        self.assertEqual(self._log(), [])
+
+    def test_change_capacity(self):
+        self._write_in_thread('a', 'b')
+        self._logger.set_capacity(1)
+        self._write_in_thread('c')
+        self.assertEqual(self._log('Background'), ['2 older messages were dropped.', 'c'])
+
+    def test_buffers_of_finished_threads_are_removed_when_logged(self):
+        self._write_in_thread('a', name='first')
+        self._write_in_thread('b', name='second')
+        self.assertEqual(self._log('first'), ['a'])
+        self.assertEqual(list(self._logger._messages), ['second'])
+        self._logger.reset_background_messages()
+        self.assertEqual(list(self._logger._messages), [])
+
+    def test_buffer_of_running_thread_is_kept(self):
+        self._logger.LOGGING_THREADS = ()
+        self._logger.write('a', 'INFO')
+        self.assertEqual(self._log(), ["<b>Messages by '%s'</b>" % threading.current_thread().name, 'a'])
+        self._logger.write('b', 'INFO')
+        self.assertEqual(self._log(threading.current_thread().name), ['b'])
+
+    def test_messages_below_log_level_are_not_stored(self):
+        logging.getLogger().setLevel(logging.INFO)
+        message = Lazy()
+        self._write_in_thread(message, level='DEBUG')
+        self._logger.debug(message)
+        self.assertEqual(self._log(), [])
+        self.assertFalse(message.formatted)
+
+    def test_is_enabled(self):
+        logging.getLogger().setLevel(logging.DEBUG)
+        self.assertFalse(self._logger.is_enabled('TRACE'))
+        self.assertTrue(self._logger.is_enabled('debug'))
+        self.assertTrue(self._logger.is_enabled('WARN'))
+
+    def test_deferred_message(self):
+        self._write_in_thread(Deferred('{} bytes'.format, 4))
+        self.assertEqual(self._log('Background'), ['4 bytes'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+from unittest import TestCase, main
+import copy
+import threading
+from Rammbock.synchronization import InstanceLock, SynchronizedType, get_lock, released
+
+
+class Node(object, metaclass=SynchronizedType):
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.proceed = threading.Event()
+
+    def wait(self):
+        self._wait()
+
+    def wait_released(self):
+        with released(self):
+            self._wait()
+
+    def _wait(self):
+        self.entered.set()
+        self.proceed.wait(2)
+
+    def touch(self):
+        return True
+
+
+class TestInstanceLock(TestCase):
+
+    def test_reentrant(self):
+        lock = InstanceLock()
+        with lock:
+            with lock:
+                pass
+            self.assertEqual(lock._count, 1)
+        self.assertEqual(lock._owner, None)
+
+    def test_released_gives_lock_to_other_threads(self):
+        lock = InstanceLock()
+        acquired = []
+        with lock:
+            with lock:
+                with lock.released():
+                    thread = threading.Thread(target=lambda: acquired.append(lock._lock.acquire(timeout=1)))
+                    thread.start()
+                    thread.join()
+                    lock._lock.release()
+            self.assertEqual(lock._count, 1)
+        self.assertEqual(acquired, [True])
+
+    def test_copied_lock_is_new_lock(self):
+        lock = InstanceLock()
+        with lock:
+            copied = copy.deepcopy(lock)
+        self.assertFalse(copied is lock)
+        self.assertIsNone(copied._owner)
+        self.assertTrue(copied._lock.acquire(False))
+
+    def test_released_without_owning_lock(self):
+        lock = InstanceLock()
+        with lock.released():
+            pass
+        self.assertEqual(lock._owner, None)
+
+
+class TestSynchronizedType(TestCase):
+
+    def _run_in_thread(self, method):
+        thread = threading.Thread(target=method)
+        thread.start()
+        return thread
+
+    def test_instances_have_own_locks(self):
+        first, second = Node(), Node()
+        self.assertFalse(get_lock(first) is get_lock(second))
+        thread = self._run_in_thread(first.wait)
+        first.entered.wait(2)
+        self.assertTrue(second.touch())
+        first.proceed.set()
+        thread.join()
+
+    def test_same_instance_is_synchronized(self):
+        node = Node()
+        thread = self._run_in_thread(node.wait)
+        node.entered.wait(2)
+        self.assertFalse(get_lock(node)._lock.acquire(timeout=0.05))
+        node.proceed.set()
+        thread.join()
+
+    def test_lock_can_be_released_while_waiting(self):
+        node = Node()
+        thread = self._run_in_thread(node.wait_released)
+        node.entered.wait(2)
+        self.assertTrue(get_lock(node)._lock.acquire(timeout=1))
+        get_lock(node)._lock.release()
+        node.proceed.set()
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
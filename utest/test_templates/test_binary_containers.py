@@ -57,6 +57,20 @@ class TestBinaryContainerTemplate(TestCase):
         self.assertEqual(0, decoded.spare.int)
         self.assertEqual(1, decoded.value.int)
 
+    def test_decode_compiled_container(self):
+        container = self._2_byte_container()
+        container.compile()
+        decoded = container.decode(to_bin("0xf00d"))
+        self.assertEqual(1, decoded.oneBit.int)
+        self.assertEqual(7, decoded.threeBits.int)
+        self.assertEqual(13, decoded.twelveBits.int)
+        self.assertEqual(decoded._raw, to_bin("0xf00d"))
+
+    def test_encode_too_long_value_fails(self):
+        container = self._2_byte_container()
+        encoded = container.encode({'foo.oneBit': 2})
+        self.assertRaises(AssertionError, getattr, encoded, '_raw')
+
     def _1_byte_container(self):
         container = BinaryContainerTemplate('foo', None)
         container.add(Binary(4, 'spare', 0))
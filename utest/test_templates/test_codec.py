@@ -0,0 +1,86 @@
+import copy
+from unittest import TestCase, main
+from Rammbock.templates.codec import compile_fields, StaticRun
+from Rammbock.templates.containers import Protocol, MessageTemplate
+from Rammbock.templates.primitives import UInt, Int, Char, PDU
+from Rammbock.binary_tools import to_bin
+from .tools import *
+
+
+class TestCompileFields(TestCase):
+
+    def test_static_fields_are_grouped_to_one_run(self):
+        plan = compile_fields([UInt(1, 'a', None), Int(2, 'b', None), Char(3, 'c', None)])
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan[0].size, 6)
+
+    def test_dynamic_field_splits_runs(self):
+        length = UInt(1, 'len', None)
+        chars = Char('len', 'chars', None)
+        plan = compile_fields([length, chars, UInt(2, 'after', None)])
+        self.assertEqual(len(plan), 3)
+        self.assertTrue(isinstance(plan[0], StaticRun))
+        self.assertTrue(plan[1] is chars)
+        self.assertTrue(isinstance(plan[2], StaticRun))
+
+    def test_terminated_chars_are_not_static(self):
+        plan = compile_fields([Char(5, 'chars', None, terminator='0x00')])
+        self.assertFalse(isinstance(plan[0], StaticRun))
+
+    def test_alignment_is_part_of_run(self):
+        plan = compile_fields([UInt(1, 'a', None, align=4), UInt(2, 'b', None)])
+        self.assertEqual(plan[0].size, 6)
+
+
+class TestCompiledDecoding(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('TestProtocol')
+        self._protocol.add(UInt(2, 'msgId', 5))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-4'))
+        self.tmp = MessageTemplate('FooRequest', self._protocol, {})
+        self.tmp.add(UInt(2, 'field_1', None, align=4))
+        self.tmp.add(UInt(1, 'len', None))
+        self.tmp.add(Char('len', 'chars', None))
+        self.tmp.add(get_pair())
+        self.tmp.compile()
+
+    def test_decode_compiled_template(self):
+        msg = self.tmp.decode(to_bin('0xcafe0000 03 616263 00010002'))
+        self.assertEqual(msg.field_1.hex, '0xcafe')
+        self.assertEqual(len(msg.field_1), 4)
+        self.assertEqual(msg.chars.ascii, 'abc')
+        self.assertEqual(msg.pair.first.int, 1)
+        self.assertEqual(msg.pair.second.int, 2)
+
+    def test_compiled_decode_little_endian(self):
+        pair = get_pair()
+        pair.compile()
+        decoded = pair.decode(to_bin('0xcafebabe'), little_endian=True)
+        self.assertEqual(decoded.first.hex, '0xfeca')
+
+    def test_compiled_decode_reports_missing_data(self):
+        self.assertRaises(Exception, self.tmp.decode, to_bin('0xcafe00'))
+
+    def test_adding_field_invalidates_compiled_plan(self):
+        pair = get_pair()
+        pair.compile()
+        pair.add(UInt(1, 'third', None))
+        decoded = pair.decode(to_bin('0x0001000203'))
+        self.assertEqual(decoded.third.int, 3)
+
+    def test_decode_compiled_header(self):
+        self._protocol.compile()
+        header, data = self._protocol.read(MockStream(to_bin('0x0005000601ff')))
+        self.assertEqual(header.msgId.int, 5)
+        self.assertEqual(header.length.int, 6)
+
+    def test_deepcopy_compiled_template(self):
+        copied = copy.deepcopy(self.tmp)
+        msg = copied.decode(to_bin('0xcafe0000 03 616263 00010002'))
+        self.assertEqual(msg.pair.second.int, 2)
+
+
+if __name__ == '__main__':
+    main()
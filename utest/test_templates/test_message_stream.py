@@ -1,9 +1,13 @@
 from unittest import TestCase, main
 from .tools import MockStream
 import socket
-from Rammbock.templates.message_stream import MessageStream
-from Rammbock.templates import Protocol, MessageTemplate, UInt, PDU
+import threading
+import time
+from Rammbock.templates.message_stream import MessageStream, _HeaderMatcher
+from Rammbock.templates import Protocol, MessageTemplate, UInt, PDU, Char
 from Rammbock.binary_tools import to_bin
+from Rammbock.message import LazyMessage
+from Rammbock.networking import BufferedStream
 
 
 class TestProtocolMessageReceiving(TestCase):
@@ -21,6 +25,59 @@ class TestProtocolMessageReceiving(TestCase):
         self.assertEqual(data, '\xca\xfe')
 
 
+class TestProtocolFraming(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('Test')
+        self._protocol.add(UInt(1, 'id', 1))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-2'))
+        self._protocol.compile()
+
+    def test_frame_length_from_header_bytes(self):
+        self.assertEqual(self._protocol.get_frame_length(to_bin('0xff0006')), 7)
+
+    def test_frame_length_little_endian(self):
+        protocol = Protocol('Test', little_endian=True)
+        protocol.add(UInt(1, 'id', 1))
+        protocol.add(UInt(2, 'length', None))
+        protocol.add(PDU('length'))
+        self.assertEqual(protocol.get_frame_length(to_bin('0xff0600')), 9)
+
+    def test_frame_length_without_pdu(self):
+        protocol = Protocol('Test')
+        protocol.add(UInt(4, 'id', 1))
+        self.assertEqual(protocol.get_frame_length(to_bin('0xcafebabe')), 4)
+
+    def test_read_frame(self):
+        header, data = self._protocol.read(MockStream(to_bin('0xff0004cafe aa')))
+        self.assertEqual(header.length.int, 4)
+        self.assertEqual(data, b'\xca\xfe')
+        self.assertTrue(isinstance(data, bytes))
+
+    def test_length_field_offset_is_compiled(self):
+        self.assertEqual(self._protocol._length_field, (1, 3, False))
+        self._protocol.compile()
+        self.assertEqual(self._protocol.get_frame_length(to_bin('0xff0006')), 7)
+
+    def test_read_buffered_frames(self):
+        stream = MockStream(to_bin('0xff0004cafe aa0003dd bb00'))
+        self._protocol.read(stream)
+        messages = self._protocol.read_buffered(stream)
+        self.assertEqual([header.id.hex for header, _ in messages], ['0xaa'])
+        self.assertEqual(stream.data, to_bin('0xbb00'))
+
+    def test_read_with_dynamic_header(self):
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'len', None))
+        protocol.add(Char('len', 'name', None))
+        protocol.add(UInt(1, 'length', None))
+        protocol.add(PDU('length'))
+        header, data = protocol.read(MockStream(to_bin('0x02 6869 01 ff')), timeout=1)
+        self.assertEqual(header.name.ascii, 'hi')
+        self.assertEqual(data, b'\xff')
+
+
 class TestMessageStream(TestCase):
 
     def setUp(self):
@@ -38,6 +95,12 @@ class TestMessageStream(TestCase):
         msg = self._msg_stream.get(self._msg, header_filter='id')
         self.assertEqual(msg.field_1.hex, '0xde')
 
+    def test_get_lazy_message(self):
+        msg = self._msg_stream.get(self._msg, header_filter='id', lazy=True)
+        self.assertTrue(isinstance(msg, LazyMessage))
+        self.assertEqual(msg.field_2.hex, '0xad')
+        self.assertEqual(msg._header.id.hex, '0xaa')
+
     def test_get_message_from_cache(self):
         _ = self._msg_stream.get(self._msg, header_filter='id')
         self._msg.header_parameters = {'id': '0xdd'}
@@ -67,6 +130,202 @@ class TestMessageStream(TestCase):
         count = self._msg_stream.get_messages_count_in_cache()
         self.assertEqual(count, 3)
 
+    def test_get_does_not_hold_lock_while_waiting(self):
+        reading, proceed = threading.Event(), threading.Event()
+        stream = self._msg_stream._stream
+        read_frame = stream.read_frame
+
+        def blocking_read_frame(*args, **kwargs):
+            reading.set()
+            proceed.wait(2)
+            return read_frame(*args, **kwargs)
+        stream.read_frame = blocking_read_frame
+        received = []
+        thread = threading.Thread(target=lambda: received.append(self._msg_stream.get(self._msg, header_filter='id')))
+        thread.start()
+        reading.wait(2)
+        self.assertTrue(self._msg_stream._lock.acquire(blocking=False))
+        self._msg_stream._lock.release()
+        self.assertEqual(self._msg_stream.match_handlers(readable=True), None)
+        proceed.set()
+        thread.join()
+        self.assertEqual(received[0].field_1.hex, '0xde')
+
+    def test_get_notices_message_cached_while_waiting(self):
+        header, pdu_bytes = self._protocol.read(MockStream(to_bin('0xaa0004dead')))
+        msg_stream = MessageStream(MockStream(b''), self._protocol)
+
+        def cache_message():
+            time.sleep(0.05)
+            with msg_stream._lock:
+                msg_stream._match_or_cache(header, pdu_bytes)
+        thread = threading.Thread(target=cache_message)
+        thread.start()
+        msg = msg_stream.get(self._msg, timeout=2, header_filter='id')
+        thread.join()
+        self.assertEqual(msg.field_1.hex, '0xde')
+
+    def test_match_handlers(self):
+        handled = []
+        self._msg_stream._handlers.append((self._msg, 'module.handler', 'id'))
+        self._msg_stream._call_handler_function = lambda func, msg: handled.append(msg)
+        self._msg_stream.match_handlers()
+        self.assertEqual([msg.field_1.hex for msg in handled], ['0xde'])
+        self.assertEqual(self._msg_stream.get_messages_count_in_cache(), 2)
+
+    def test_matchers_of_least_recently_used_values_are_dropped(self):
+        self._msg_stream._max_matchers = 2
+        first = self._msg_stream._get_matcher({'id': '0x01'}, 'id')
+        self._msg_stream._get_matcher({'id': '0x02'}, 'id')
+        self.assertIs(self._msg_stream._get_matcher({'id': '0x01'}, 'id'), first)
+        self._msg_stream._get_matcher({'id': '0x03'}, 'id')
+        self.assertEqual(sorted(self._msg_stream._matchers), [('id', '0x01'), ('id', '0x03')])
+
+    def test_get_many_messages_from_buffer(self):
+        messages = list(self._msg_stream.get_messages(self._msg, 2))
+        self.assertEqual([msg.field_1.hex for msg in messages], ['0xca', '0xde'])
+        self.assertEqual(self._msg_stream.get_messages_count_in_cache(), 1)
+
+    def test_get_many_messages_from_cache_and_stream(self):
+        _ = self._msg_stream.get(self._msg, header_filter='id')
+        self._msg.header_parameters = {'id': '0xdd'}
+        messages = self._msg_stream.get_messages(self._msg, 2, timeout=0.1, header_filter='id')
+        self.assertEqual(next(messages).field_1.hex, '0xbe')
+        self.assertRaises(socket.timeout, next, messages)
+
+    def test_match_handlers_keeps_buffered_messages_before_partial_message(self):
+        self._msg_stream._stream.data += to_bin('0xaa00')
+        self.assertTrue(self._msg_stream.match_handlers(readable=True))
+        self.assertEqual(len(self._msg_stream._cache), 3)
+        self.assertEqual(self._msg_stream._stream.data, to_bin('0xaa00'))
+
+    def test_match_handlers_of_partial_and_closed_connection(self):
+        connection = _MockConnection(to_bin('0xaa00'))
+        msg_stream = MessageStream(BufferedStream(connection, 0.1), self._protocol)
+        self.assertTrue(msg_stream.match_handlers(readable=True))
+        connection.closed = True
+        self.assertFalse(msg_stream.match_handlers(readable=True))
+
+
+class _MockConnection(object):
+
+    def __init__(self, *data):
+        self._data = list(data)
+        self.closed = False
+
+    def receive_into(self, buffer, timeout):
+        if self._data:
+            data = self._data.pop(0)
+            buffer[:len(data)] = data
+            return len(data)
+        if self.closed:
+            return 0
+        raise socket.timeout('timeout')
+
+
+class TestMessageCache(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('Test')
+        self._protocol.add(UInt(1, 'id', 1))
+        self._protocol.add(Char(2, 'name', None))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-5'))
+        self._msg = MessageTemplate('FooRequest', self._protocol, {})
+        self._msg.add(UInt(1, 'field', None))
+        stream = MockStream(to_bin('0x01 6161 0006 01 02 6262 0006 02 01 6161 0006 03 03 6363 0006 04'))
+        self._msg_stream = MessageStream(stream, self._protocol)
+        self._msg_stream._fill_cache()
+
+    def _get(self, header_filter=None, latest=False, **params):
+        self._msg.header_parameters = params
+        return self._msg_stream.get(self._msg, header_filter=header_filter, latest=latest).field.int
+
+    def test_messages_are_taken_in_arrival_order(self):
+        self.assertEqual([self._get() for _ in range(4)], [1, 2, 3, 4])
+
+    def test_get_by_indexed_uint(self):
+        self.assertEqual(self._get('id', id='1'), 1)
+        self.assertEqual(self._get('id', id='1'), 3)
+        self.assertEqual(self._get(), 2)
+
+    def test_get_latest_by_indexed_chars(self):
+        self.assertEqual(self._get('name', latest=True, name='aa'), 3)
+        self.assertEqual(self._get('name', latest=True, name='aa'), 1)
+        self.assertEqual(self._msg_stream.get_messages_count_in_cache(), 2)
+
+    def test_index_is_updated_with_new_messages(self):
+        self.assertEqual(self._get('id', id='3'), 4)
+        self._msg_stream._cache.append(self._msg_stream._cache.pop_first(lambda header: True))
+        self.assertEqual(self._get('id', id='1'), 3)
+        self.assertEqual(self._get('id', id='1'), 1)
+
+    def test_messages_taken_in_order_are_not_found_by_index(self):
+        self.assertEqual(self._get('id', id='1'), 1)
+        self.assertEqual(self._get(), 2)
+        self.assertEqual(self._get(), 3)
+        self.assertEqual(self._get('name', name='cc'), 4)
+        self.assertEqual(self._msg_stream.get_messages_count_in_cache(), 0)
+
+    def test_stale_index_entries_are_counted(self):
+        cache = self._msg_stream._cache
+        self.assertEqual(self._get('id', id='1'), 1)
+        self.assertEqual(self._get('name', name='bb'), 2)
+        self.assertEqual(cache._stale, 1)
+        self.assertEqual(self._get(), 3)
+        self.assertEqual(cache._stale, 3)
+        self.assertEqual(self._get('name', name='cc'), 4)
+        self.assertEqual(cache._stale, 4)
+
+    def test_get_by_regexp_scans_cache(self):
+        self.assertEqual(self._get('name', name='REGEXP:[bc]+'), 2)
+        self.assertEqual(self._get('name', latest=True, name='REGEXP:[bc]+'), 4)
+
+
+class TestHeaderMatcher(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('Test')
+        self._protocol.add(UInt(2, 'id', None))
+        self._protocol.add(Char(3, 'name', None))
+        self._protocol.add(UInt(1, 'length', None))
+        self._protocol.add(PDU('length-6'))
+        self._header, _ = self._protocol.read(MockStream(to_bin('0x0102 616200 06')))
+
+    def _matcher(self, name, value):
+        return _HeaderMatcher(name, value, self._protocol._get_field(name))
+
+    def test_uint_is_compared_as_bytes(self):
+        matcher = self._matcher('id', '258')
+        self.assertEqual(matcher.key, b'\x01\x02')
+        self.assertTrue(matcher(self._header))
+        self.assertFalse(self._matcher('id', '0x0103')(self._header))
+
+    def test_too_large_uint_does_not_match(self):
+        self.assertFalse(self._matcher('id', '0x010102')(self._header))
+
+    def test_chars_are_compared_as_ascii(self):
+        self.assertTrue(self._matcher('name', 'ab')(self._header))
+        self.assertFalse(self._matcher('name', 'abc')(self._header))
+
+    def test_regexp_is_compiled_once(self):
+        matcher = self._matcher('name', 'REGEXP:a.')
+        self.assertEqual(matcher.key, None)
+        self.assertEqual(matcher._regexp.pattern, 'a.')
+        self.assertTrue(matcher(self._header))
+
+    def test_invalid_regexp(self):
+        self.assertRaises(Exception, self._matcher, 'name', 'REGEXP:(a')
+
+    def test_matcher_without_template_field(self):
+        matcher = _HeaderMatcher('id', '0x0102')
+        self.assertTrue(matcher(self._header))
+        self.assertEqual(matcher.key, 258)
+
+    def test_matchers_are_reused(self):
+        stream = MessageStream(MockStream(b''), self._protocol)
+        self.assertTrue(stream._get_matcher({'id': '1'}, 'id') is stream._get_matcher({'id': '1'}, 'id'))
+
 
 if __name__ == '__main__':
     main()
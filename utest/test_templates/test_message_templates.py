@@ -30,6 +30,17 @@ class TestMessageTemplate(TestCase):
         self.assertEqual(msg.field_1.hex, '0x0400')
         self.assertEqual(msg.field_1.bytes, '\x04\x00')
 
+    def test_validator_encodes_expected_values_once(self):
+        field = self.tmp._fields['field_1']
+        encode_value = field._encode_value
+        encoded = []
+        field._encode_value = lambda *args, **kwargs: encoded.append(args) or encode_value(*args, **kwargs)
+        validate = self.tmp.get_validator({'field_1': '3'}, {'msgId': '5'})
+        self.assertEqual(validate(self.tmp.encode({'field_1': '3'}, {})), [])
+        self.assertEqual(len(validate(self.tmp.encode({}, {}))), 1)
+        self.assertEqual([args[0] for args in encoded], ['3', '3', '1'])
+        self.assertEqual(self.tmp.validate(self.tmp.encode({}, {}), {'field_1': '1'}, {}), [])
+
     def test_encode_template_with_params(self):
         msg = self.tmp.encode({'field_1': 111, 'field_2': 222}, {})
         self.assertEqual(msg.field_1.int, 111)
@@ -65,6 +76,65 @@ class TestMessageTemplate(TestCase):
         msg = self.tmp.decode(to_bin('0xcafebabe'))
         self.assertEqual(msg.field_1.hex, '0xcafe')
 
+    def test_decoded_fields_refer_to_received_data(self):
+        data = to_bin('0xcafebabe')
+        msg = self.tmp.decode(data)
+        self.assertTrue(msg.field_2._data.obj is data)
+        self.assertEqual(msg.field_2.bytes, b'\xba\xbe')
+
+
+class TestLazyDecoding(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('TestProtocol')
+        self._protocol.add(UInt(2, 'msgId', 5))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-4'))
+        self.tmp = MessageTemplate('FooRequest', self._protocol, {})
+        self.tmp.add(UInt(1, 'type', None))
+        self.tmp.add(UInt(1, 'len', None))
+        self.tmp.add(Char('len', 'chars', None))
+        self.tmp.add(UInt(2, 'last', None))
+        self.tmp.compile()
+        self.data = to_bin('0x07 03 616263 cafe')
+
+    def test_static_field_is_decoded_alone(self):
+        msg = self.tmp.decode(self.data, lazy=True)
+        self.assertEqual(msg.type.int, 7)
+        self.assertEqual(list(msg._decoded), ['type'])
+
+    def test_field_after_dynamic_field_decodes_message(self):
+        msg = self.tmp.decode(self.data, lazy=True)
+        self.assertEqual(msg.last.hex, '0xcafe')
+        self.assertEqual(list(msg._fields), ['type', 'len', 'chars', 'last'])
+
+    def test_dynamic_length_refers_to_lazily_decoded_field(self):
+        msg = self.tmp.decode(self.data, lazy=True)
+        self.assertEqual(msg.chars.ascii, 'abc')
+
+    def test_lazy_message_equals_eager_message(self):
+        lazy = self.tmp.decode(self.data, lazy=True)
+        lazy.type
+        self.assertEqual(repr(lazy), repr(self.tmp.decode(self.data)))
+        self.assertEqual(len(lazy), len(self.data))
+
+    def test_header_is_kept_first(self):
+        msg = self.tmp.decode(self.data, lazy=True)
+        msg.type
+        msg._add_header('header')
+        self.assertEqual(list(msg._fields)[0], '_header')
+        self.assertEqual(msg._header, 'header')
+
+    def test_contains(self):
+        msg = self.tmp.decode(self.data, lazy=True)
+        self.assertTrue('last' in msg)
+        self.assertFalse('unknown' in msg)
+
+    def test_too_long_message_fails_when_decoded(self):
+        msg = self.tmp.decode(self.data + b'\x00', lazy=True)
+        self.assertEqual(msg.type.int, 7)
+        self.assertRaises(AssertionError, len, msg)
+
 
 class TestDefaultValues(TestCase):
 
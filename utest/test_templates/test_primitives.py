@@ -22,6 +22,13 @@ class TestTemplateFields(TestCase):
         self.assertEqual(field.type, 'uint')
         self.assertEqual(field.encode({}, {}, None).hex, '0x0000000008')
 
+    def test_default_value_is_encoded_once(self):
+        field = UInt(2, "field", '0x48')
+        first = field.encode({}, {}, None)
+        self.assertIs(field.encode({}, {}, None)._original_value, first._original_value)
+        self.assertEqual(field.encode({'field': '0x49'}, {}, None).hex, '0x0049')
+        self.assertEqual(field.encode({}, {}, None, little_endian=True)._raw, to_bin('0x4800'))
+
     def test_char_static_field(self):
         field = Char(5, "char_field", 'foo')
         self.assertTrue(field.length.static)
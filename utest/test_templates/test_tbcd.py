@@ -77,6 +77,17 @@ class TestTBCDContainerTemplate(TestCase):
         self.assertEqual('123', decoded.first.tbcd)
         self.assertEqual('6100000000001', decoded.second.tbcd)
 
+    def test_decode_fields_starting_from_high_nibble(self):
+        container = TBCDContainerTemplate('tbcd', None)
+        container.add(TBCD('1', 'first', None))
+        container.add(TBCD('2', 'second', None))
+        container.add(TBCD('*', 'third', None))
+        decoded = container.decode(to_bin('0x21 43 65 f7'))
+        self.assertEqual('1', decoded.first.tbcd)
+        self.assertEqual('23', decoded.second.tbcd)
+        self.assertEqual('4567', decoded.third.tbcd)
+        self.assertEqual(to_bin('0x5476'), decoded.third._original_value)
+
     def test_encoded_even_value_container_returns_correct_length(self):
         container = TBCDContainerTemplate('tbcd', None)
         container.add(TBCD('3', 'first', '123'))
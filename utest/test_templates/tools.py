@@ -1,4 +1,5 @@
 import socket
+import threading
 from contextlib import contextmanager
 from Rammbock.templates.containers import Protocol, MessageTemplate, StructTemplate, ListTemplate, UnionTemplate, BinaryContainerTemplate, TBCDContainerTemplate, ConditionalTemplate
 from Rammbock.templates.primitives import UInt, PDU, Char, Binary, TBCD
@@ -71,9 +72,12 @@ def get_struct_with_length_and_alignment():
 
 
 class MockStream(object):
+    default_timeout = None
 
     def __init__(self, data):
         self.data = data
+        self.lock = threading.RLock()
+        self.eof = False
 
     def read(self, length, timeout=None):
         if length > len(self.data):
@@ -85,12 +89,29 @@ class MockStream(object):
         self.data = self.data[length:]
         return result
 
+    def read_frame(self, header_length, get_frame_length, timeout=None):
+        if header_length > len(self.data):
+            return self.read(header_length, timeout)
+        return self.read(get_frame_length(self.data[:header_length]), timeout)
+
+    def read_frames(self, header_length, get_frame_length):
+        frames = []
+        while len(self.data) >= header_length:
+            length = get_frame_length(self.data[:header_length])
+            if length > len(self.data):
+                break
+            frames.append(self.read(length))
+        return frames
+
     def return_data(self, data):
         self.data = data + self.data
 
     def empty(self):
         self.data = ''
 
+    def close(self):
+        self.empty()
+
     @contextmanager
     def sync_threads(self):
         yield